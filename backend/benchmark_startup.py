@@ -0,0 +1,103 @@
+# backend/benchmark_startup.py
+#
+# Measures backend cold-start: the time to `import main` and to run the FastAPI lifespan
+# start-up, each in a fresh interpreter, plus the most expensive imports (python -X importtime).
+#
+#   python benchmark_startup.py                          # print results
+#   python benchmark_startup.py --save startup.json      # record a baseline
+#   python benchmark_startup.py --baseline startup.json  # fail if start-up regressed
+
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Runs in a fresh interpreter: times `import main`, then the lifespan start-up/shutdown
+PROBE = """
+import json, time, asyncio
+started = time.perf_counter()
+import main
+imported = time.perf_counter()
+
+async def run_lifespan():
+    async with main.app.router.lifespan_context(main.app):
+        pass
+
+asyncio.run(run_lifespan())
+finished = time.perf_counter()
+print(json.dumps({"import": imported - started, "startup": finished - imported}))
+"""
+
+
+def run_probe() -> dict:
+    """Times one cold start in a new interpreter."""
+    output = subprocess.run([sys.executable, "-c", PROBE], cwd=BACKEND_DIR, capture_output=True, text=True, check=True)
+    return json.loads(output.stdout.strip().splitlines()[-1])
+
+
+def import_breakdown(top: int) -> list:
+    """Modules imported directly by `main`, sorted by cumulative import time (seconds)."""
+    output = subprocess.run([sys.executable, "-X", "importtime", "-c", "import main"],
+                            cwd=BACKEND_DIR, capture_output=True, text=True, check=True)
+    # -X importtime prints children before their parent, indented 2 spaces per level:
+    # collect depth-1 modules until the top-level line that owns them shows up
+    children, costs = [], []
+    for line in output.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip(" ")) - 1) // 2
+        if depth == 1:
+            children.append((name.strip(), int(cumulative) / 1e6))
+        elif depth == 0:
+            if name.strip() == "main":
+                costs = children
+            children = []
+    return sorted(costs, key=lambda cost: cost[1], reverse=True)[:top]
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark backend import and start-up time.")
+    parser.add_argument("--runs", type=int, default=5, help="Cold starts to measure")
+    parser.add_argument("--top", type=int, default=10, help="Slowest imports to list")
+    parser.add_argument("--save", help="Write the results to this JSON file")
+    parser.add_argument("--baseline", help="Compare against a JSON file written with --save")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed slowdown vs the baseline (0.2 = 20%%)")
+    args = parser.parse_args(argv)
+
+    runs = [run_probe() for _ in range(args.runs)]
+    results = {
+        "import_seconds": statistics.median(run["import"] for run in runs),
+        "startup_seconds": statistics.median(run["startup"] for run in runs),
+        "slowest_imports": import_breakdown(args.top),
+    }
+    results["total_seconds"] = results["import_seconds"] + results["startup_seconds"]
+
+    print(f"import main:      {results['import_seconds'] * 1000:8.1f} ms (median of {args.runs})")
+    print(f"lifespan startup: {results['startup_seconds'] * 1000:8.1f} ms")
+    print(f"total:            {results['total_seconds'] * 1000:8.1f} ms")
+    print("slowest imports by main (cumulative):")
+    for name, seconds in results["slowest_imports"]:
+        print(f"  {seconds * 1000:8.1f} ms  {name}")
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        limit = baseline["total_seconds"] * (1 + args.tolerance)
+        if results["total_seconds"] > limit:
+            print(f"❌ Start-up regressed: {results['total_seconds']:.3f}s > {limit:.3f}s allowed", file=sys.stderr)
+            return 1
+        print(f"✅ Within {args.tolerance:.0%} of baseline ({baseline['total_seconds']:.3f}s)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
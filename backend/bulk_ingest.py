@@ -0,0 +1,264 @@
+# backend/bulk_ingest.py
+#
+# Offline bulk ingestion: converts whole directories (or a manifest) of PDFs to Markdown in S3.
+#
+#   python bulk_ingest.py /data/archive --workers 8
+#   python bulk_ingest.py --manifest pdfs.txt --checkpoint ingest.db
+#   python bulk_ingest.py /data/sample --endpoint-url http://localhost:9000   # MinIO / moto_server
+#   python bulk_ingest.py /data/sample --storage local                        # LOCAL_STORAGE_DIR, no S3
+#
+# Progress is checkpointed in SQLite after every file, so an interrupted run resumes where it stopped.
+# Files whose content hash was already converted are skipped.
+
+import os
+import sys
+import time
+import hashlib
+import sqlite3
+import argparse
+import datetime
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+from dotenv import load_dotenv
+
+HASH_CHUNK_SIZE = 1024 * 1024
+REPORT_INTERVAL = 10  # Seconds between progress lines
+
+
+########################################
+#          Checkpoint (SQLite)         #
+########################################
+def open_checkpoint(path: str) -> sqlite3.Connection:
+    """Opens (or creates) the checkpoint database that records every processed PDF."""
+    conn = sqlite3.connect(path)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS ingested (
+            content_hash TEXT PRIMARY KEY,
+            path TEXT,
+            size INTEGER,
+            mtime REAL,
+            pdf_name TEXT,
+            status TEXT,
+            markdown_url TEXT,
+            error TEXT,
+            seconds REAL,
+            updated_at TEXT
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS ingested_path ON ingested (path)")
+    conn.execute("CREATE INDEX IF NOT EXISTS ingested_pdf_name ON ingested (pdf_name)")
+    conn.commit()
+    return conn
+
+
+def is_unchanged_and_done(conn: sqlite3.Connection, path: str, size: int, mtime: float) -> bool:
+    """True if this exact file (path, size, mtime) was already converted, so it need not be hashed again."""
+    row = conn.execute(
+        "SELECT 1 FROM ingested WHERE path = ? AND size = ? AND mtime = ? AND status = 'done'",
+        (path, size, mtime),
+    ).fetchone()
+    return row is not None
+
+
+def is_hash_done(conn: sqlite3.Connection, content_hash: str) -> bool:
+    row = conn.execute("SELECT 1 FROM ingested WHERE content_hash = ? AND status = 'done'", (content_hash,)).fetchone()
+    return row is not None
+
+
+def name_taken_by_other_path(conn: sqlite3.Connection, pdf_name: str, path: str) -> bool:
+    row = conn.execute("SELECT 1 FROM ingested WHERE pdf_name = ? AND path != ?", (pdf_name, path)).fetchone()
+    return row is not None
+
+
+def record_result(conn: sqlite3.Connection, item: dict, status: str, markdown_url=None, error=None, seconds=None):
+    conn.execute(
+        "INSERT OR REPLACE INTO ingested VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        (item["content_hash"], item["path"], item["size"], item["mtime"], item["pdf_name"], status,
+         markdown_url, error, seconds, datetime.datetime.now().isoformat(timespec="seconds")),
+    )
+    conn.commit()
+
+
+########################################
+#            Input Discovery           #
+########################################
+def iter_pdf_paths(source: str | None, manifest: str | None):
+    """Yields PDF paths from a directory tree and/or a manifest file (one path per line, '#' comments)."""
+    if manifest:
+        with open(manifest, encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if line and not line.startswith("#"):
+                    yield os.path.abspath(line)
+    if source:
+        for root, _, files in os.walk(source):
+            for name in sorted(files):
+                if name.lower().endswith(".pdf"):
+                    yield os.path.abspath(os.path.join(root, name))
+
+
+def unique_pdf_name(conn: sqlite3.Connection, claimed: dict, path: str, content_hash: str) -> str:
+    """
+    Storage folder name for a PDF. Files with the same basename in different directories
+    (a/report.pdf, b/report.pdf) would overwrite each other's Markdown and images, so every
+    path after the first to claim a name gets a content-hash suffix.
+    """
+    from pdf_markdown_convertor import clean_pdf_name
+
+    pdf_name = clean_pdf_name(path)
+    if claimed.get(pdf_name, path) != path or name_taken_by_other_path(conn, pdf_name, path):
+        pdf_name = f"{pdf_name}_{content_hash[:12]}"
+    claimed[pdf_name] = path
+    return pdf_name
+
+
+def file_hash(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+########################################
+#         Conversion (worker side)     #
+########################################
+def convert_pdf(path: str, pdf_name: str) -> tuple:
+    """Runs in a worker process: converts one PDF with the same pipeline as /upload_pdf/."""
+    from pdf_markdown_convertor import pdf_to_markdown_s3  # Imported here so each process builds its own storage client
+
+    started = time.perf_counter()
+    result = pdf_to_markdown_s3(path, pdf_name)
+    if not result.get("pdf_url"):
+        raise RuntimeError("PDF upload to storage failed")
+    if not result.get("markdown_url"):
+        raise RuntimeError("Markdown upload to storage failed")
+    return result["markdown_url"], time.perf_counter() - started
+
+
+########################################
+#             Progress Report          #
+########################################
+class Progress:
+    """Counts outcomes and prints throughput (files/s, MB/s) with an ETA."""
+
+    def __init__(self, total: int | None):
+        self.total = total
+        self.started = time.monotonic()
+        self.last_report = self.started
+        self.done = self.skipped = self.failed = 0
+        self.bytes_done = 0
+
+    def report(self, force: bool = False):
+        now = time.monotonic()
+        if not force and now - self.last_report < REPORT_INTERVAL:
+            return
+        self.last_report = now
+        elapsed = max(now - self.started, 1e-6)
+        rate = self.done / elapsed
+        line = (f"converted {self.done} | skipped {self.skipped} | failed {self.failed} | "
+                f"{rate:.2f} files/s | {self.bytes_done / elapsed / 1e6:.2f} MB/s | {elapsed:.0f}s elapsed")
+        if self.total and rate > 0:
+            remaining = self.total - self.done - self.skipped - self.failed
+            line += f" | ETA {remaining / rate:.0f}s"
+        print(line, flush=True)
+
+
+########################################
+#              Main Loop               #
+########################################
+def ingest(paths, checkpoint: str, workers: int, total: int | None = None) -> Progress:
+    """Converts `paths` on a process pool, skipping converted content and checkpointing every result."""
+    conn = open_checkpoint(checkpoint)
+    progress = Progress(total)
+    in_flight = {}  # future -> item
+    seen_hashes = set()
+    claimed_names = {}  # pdf_name -> path, for names handed out in this run
+    max_in_flight = workers * 2  # Keeps memory flat on very large inputs
+
+    def collect(done_futures):
+        for future in done_futures:
+            item = in_flight.pop(future)
+            try:
+                markdown_url, seconds = future.result()
+            except Exception as e:
+                progress.failed += 1
+                record_result(conn, item, "failed", error=str(e))
+                print(f"❌ {item['path']}: {e}", file=sys.stderr, flush=True)
+                continue
+            progress.done += 1
+            progress.bytes_done += item["size"]
+            record_result(conn, item, "done", markdown_url=markdown_url, seconds=seconds)
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for path in paths:
+            try:
+                stat = os.stat(path)
+                if is_unchanged_and_done(conn, path, stat.st_size, stat.st_mtime):
+                    progress.skipped += 1
+                    continue
+                content_hash = file_hash(path)
+            except OSError as e:
+                progress.failed += 1
+                print(f"❌ {path}: {e}", file=sys.stderr, flush=True)
+                continue
+
+            if content_hash in seen_hashes or is_hash_done(conn, content_hash):
+                progress.skipped += 1
+                continue
+            seen_hashes.add(content_hash)
+
+            item = {"path": path, "size": stat.st_size, "mtime": stat.st_mtime,
+                    "content_hash": content_hash,
+                    "pdf_name": unique_pdf_name(conn, claimed_names, path, content_hash)}
+            in_flight[executor.submit(convert_pdf, path, item["pdf_name"])] = item
+
+            if len(in_flight) >= max_in_flight:
+                done_futures, _ = wait(list(in_flight), return_when=FIRST_COMPLETED)
+                collect(done_futures)
+            progress.report()
+
+        while in_flight:
+            done_futures, _ = wait(list(in_flight), timeout=REPORT_INTERVAL, return_when=FIRST_COMPLETED)
+            collect(done_futures)
+            progress.report()
+
+    conn.close()
+    progress.report(force=True)
+    return progress
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Bulk-convert PDFs to Markdown in S3.")
+    parser.add_argument("source", nargs="?", help="Directory to scan recursively for PDFs")
+    parser.add_argument("--manifest", help="Text file listing PDF paths, one per line")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 4, help="Conversion processes")
+    parser.add_argument("--checkpoint", default="bulk_ingest.db", help="SQLite checkpoint file (enables resume)")
+    parser.add_argument("--endpoint-url", help="S3-compatible endpoint, e.g. a local MinIO for testing")
+    parser.add_argument("--bucket", help="Target bucket (defaults to S3_BUCKET_NAME)")
+    parser.add_argument("--storage", choices=["s3", "local", "write_through"],
+                        help="Storage backend (defaults to STORAGE_BACKEND, else s3)")
+    args = parser.parse_args(argv)
+
+    if not args.source and not args.manifest:
+        parser.error("give a source directory and/or --manifest")
+
+    # Must be set before the storage backend is created (worker processes inherit the environment)
+    load_dotenv()
+    if args.endpoint_url:
+        os.environ["S3_ENDPOINT_URL"] = args.endpoint_url
+    if args.bucket:
+        os.environ["S3_BUCKET_NAME"] = args.bucket
+    if args.storage:
+        os.environ["STORAGE_BACKEND"] = args.storage
+
+    total = None
+    if args.manifest and not args.source:
+        total = sum(1 for _ in iter_pdf_paths(None, args.manifest))
+
+    progress = ingest(iter_pdf_paths(args.source, args.manifest), args.checkpoint, args.workers, total)
+    return 1 if progress.failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,150 @@
+# backend/chat_memory.py
+
+import json
+import uuid
+
+# Session settings
+SESSION_TTL = 60 * 60 * 24  # Sessions expire after 24 hours without activity
+NEW_SESSION = "new"  # session_id a client sends to start a session (requests without one stay stateless)
+MAX_RECENT_TURNS = 6  # Question/answer pairs kept verbatim after a compaction
+COMPACT_AT_TURNS = 12  # Compaction only runs once the verbatim history grows past this many pairs
+MAX_HISTORY_CHARS = 12000  # Verbatim history above this size is compacted early...
+COMPACT_TO_CHARS = 6000  # ...down to this size
+MAX_SUMMARY_CHARS = 4000  # Upper bound for the rolling summary of older turns
+
+
+########################################
+#         Session Storage (Redis)      #
+########################################
+def session_key(session_id: str) -> str:
+    """Redis key holding a chat session."""
+    return f"chat_session:{session_id}"
+
+
+def create_session(redis_client, pdf_name: str, markdown_filename: str | None = None) -> str:
+    """Creates an empty chat session bound to one document and returns its id."""
+    session_id = uuid.uuid4().hex
+    session = {
+        "pdf_name": pdf_name,
+        "markdown_filename": markdown_filename,
+        "summary": "",
+        "turns": [],
+    }
+    save_session(redis_client, session_id, session)
+    return session_id
+
+
+def load_session(redis_client, session_id: str) -> dict | None:
+    """Loads a chat session from Redis. Returns None if it does not exist or has expired."""
+    raw = redis_client.get(session_key(session_id))
+    if not raw:
+        return None
+    try:
+        return json.loads(raw)
+    except json.JSONDecodeError:
+        return None
+
+
+def save_session(redis_client, session_id: str, session: dict):
+    """Stores the session and refreshes its TTL."""
+    redis_client.setex(session_key(session_id), SESSION_TTL, json.dumps(session))
+
+
+def delete_session(redis_client, session_id: str) -> bool:
+    """Deletes a chat session. Returns True if it existed."""
+    return bool(redis_client.delete(session_key(session_id)))
+
+
+########################################
+#           History Handling           #
+########################################
+def get_history(session: dict | None) -> dict:
+    """Returns the part of the session that is sent to the LLM: rolling summary + recent turns."""
+    if not session:
+        return {"summary": "", "turns": []}
+    return {"summary": session.get("summary", ""), "turns": session.get("turns", [])}
+
+
+def append_turn(redis_client, session_id: str, session: dict, question: str, answer: str) -> bool:
+    """
+    Adds a question/answer pair to the session and saves it.
+    Returns True if the history is now due for compaction (see `compact_stored_session`).
+    """
+    session.setdefault("turns", []).extend([
+        {"role": "user", "content": question},
+        {"role": "assistant", "content": answer},
+    ])
+    save_session(redis_client, session_id, session)
+    return _compaction_split(session["turns"]) > 0
+
+
+def _history_chars(turns: list) -> int:
+    return sum(len(turn["content"]) for turn in turns)
+
+
+def _extractive_summary(previous_summary: str, turns: list) -> str:
+    """Fallback summary: keeps each old question and the start of its answer."""
+    lines = [previous_summary] if previous_summary else []
+    for turn in turns:
+        prefix = "Q" if turn["role"] == "user" else "A"
+        content = " ".join(turn["content"].split())
+        lines.append(f"{prefix}: {content[:200]}")
+    return "\n".join(lines)
+
+
+def _compaction_split(turns: list) -> int:
+    """
+    Number of leading turns to fold into the summary (0 = none). Once the verbatim history exceeds
+    `COMPACT_AT_TURNS` pairs (or `MAX_HISTORY_CHARS`), it is cut back to `MAX_RECENT_TURNS` pairs
+    (and `COMPACT_TO_CHARS`) in one go, so the summarizer runs once every few turns.
+    """
+    if len(turns) <= COMPACT_AT_TURNS * 2 and _history_chars(turns) <= MAX_HISTORY_CHARS:
+        return 0
+
+    split = max(len(turns) - MAX_RECENT_TURNS * 2, 0)
+
+    # Drop whole question/answer pairs until the verbatim part fits the character budget
+    while split < len(turns) - 2 and _history_chars(turns[split:]) > COMPACT_TO_CHARS:
+        split += 2
+    return split
+
+
+def compact_stored_session(redis_client, session_id: str, summarizer=None) -> dict | None:
+    """
+    Folds the older turns of a stored session into its rolling summary using
+    `summarizer(previous_summary, turns)`, falling back to an extractive summary if no summarizer
+    is given or it fails. Meant to run off the request path (e.g. as a background task).
+
+    The summarizer may be slow, so the session is loaded again before saving: if other requests
+    changed the compacted part in the meantime, the result is dropped (their turns are kept).
+    Returns the summarizer's answer dict so the caller can record its usage; None if no LLM summary was made.
+    """
+    session = load_session(redis_client, session_id)
+    if session is None:
+        return None
+    turns = session.get("turns", [])
+    split = _compaction_split(turns)
+    if split == 0:
+        return None
+
+    old_turns = turns[:split]
+    previous_summary = session.get("summary", "")
+
+    summary_answer = None
+    if summarizer:
+        try:
+            summary_answer = summarizer(previous_summary, old_turns)
+        except Exception as e:
+            print(f"⚠️ History summarization failed, using extractive summary: {e}")
+    summary = (summary_answer or {}).get("response")
+    if not summary:
+        summary = _extractive_summary(previous_summary, old_turns)
+
+    latest = load_session(redis_client, session_id)
+    if (latest is None or latest.get("summary", "") != previous_summary
+            or latest.get("turns", [])[:split] != old_turns):
+        return summary_answer
+    latest["summary"] = summary[-MAX_SUMMARY_CHARS:]
+    latest["turns"] = latest["turns"][split:]
+    save_session(redis_client, session_id, latest)
+    return summary_answer
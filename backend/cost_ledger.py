@@ -0,0 +1,135 @@
+# backend/cost_ledger.py
+
+import logging
+import datetime
+
+# USD per 1M tokens. "cached_input" is a prompt-cache read, "cache_write" a prompt-cache write
+# (Claude only); both are already included in a call's input token count.
+MODEL_PRICING = {
+    "gpt-4o mini": {"model": "gpt-4o-mini", "input": 0.15, "cached_input": 0.075, "output": 0.60},
+    "gemini flash free": {"model": "gemini-1.5-pro-002", "input": 1.25, "cached_input": 0.3125, "output": 5.00},
+    "deepseek chat": {"model": "deepseek-chat", "input": 0.27, "cached_input": 0.07, "output": 1.10},
+    "claude-3.5 haiku": {"model": "claude-3-5-haiku-20241022", "input": 0.80, "cached_input": 0.08,
+                         "cache_write": 1.00, "output": 4.00},
+}
+
+LEDGER_STREAM = "usage_ledger"
+LEDGER_MAX_ENTRIES = 1000000  # Approximate cap on the raw stream; aggregates are kept separately
+AGGREGATE_DIMENSIONS = ("document", "model", "day")
+AGGREGATE_FIELDS = ("requests", "cache_hits", "input_tokens", "cached_input_tokens", "output_tokens",
+                    "cost", "saved_response_cache", "saved_prompt_cache")
+
+
+########################################
+#              Pricing                 #
+########################################
+def compute_cost(provider: str, input_tokens: int, output_tokens: int, cached_input_tokens: int = 0,
+                 cache_write_tokens: int = 0) -> float:
+    """Cost in USD of one LLM call, from the pricing table. Unknown providers cost 0."""
+    pricing = MODEL_PRICING.get(provider)
+    if not pricing:
+        return 0.0
+    uncached = max(input_tokens - cached_input_tokens - cache_write_tokens, 0)
+    cost = (uncached * pricing["input"]
+            + cached_input_tokens * pricing.get("cached_input", pricing["input"])
+            + cache_write_tokens * pricing.get("cache_write", pricing["input"])
+            + output_tokens * pricing["output"])
+    return cost / 1_000_000
+
+
+def prompt_cache_savings(provider: str, cached_input_tokens: int) -> float:
+    """What the prompt-cache hits saved compared to paying the full input price."""
+    pricing = MODEL_PRICING.get(provider)
+    if not pricing or not cached_input_tokens:
+        return 0.0
+    return cached_input_tokens * (pricing["input"] - pricing.get("cached_input", pricing["input"])) / 1_000_000
+
+
+########################################
+#          Usage Ledger (Redis)        #
+########################################
+def usage_entry(kind: str, pdf_name: str, answer: dict, cache_hit: bool = False) -> dict:
+    """
+    Builds one ledger entry from an answer dict. For response-cache hits nothing is spent and the
+    original cost of the answer is recorded as saved spend.
+    """
+    routing = answer.get("routing") or {}
+    model = answer.get("model") or routing.get("served_by") or "unknown"
+    cached_input_tokens = round(answer.get("cached_input_tokens") or 0)
+    now = datetime.datetime.now(datetime.timezone.utc)
+    entry = {
+        "ts": now.isoformat(timespec="seconds"),
+        "day": now.date().isoformat(),
+        "kind": kind,
+        "document": pdf_name,
+        "model": model,
+        "cache_hit": int(cache_hit),
+        "input_tokens": 0,
+        "cached_input_tokens": 0,
+        "output_tokens": 0,
+        "cost": 0.0,
+        "saved_response_cache": 0.0,
+        "saved_prompt_cache": 0.0,
+    }
+    if cache_hit:
+        entry["saved_response_cache"] = float(answer.get("cost") or 0.0)
+    else:
+        entry.update({
+            "input_tokens": round(answer.get("input_tokens") or 0),
+            "cached_input_tokens": cached_input_tokens,
+            "output_tokens": round(answer.get("output_tokens") or 0),
+            "cost": float(answer.get("cost") or 0.0),
+            "saved_prompt_cache": prompt_cache_savings(model, cached_input_tokens),
+        })
+    return entry
+
+
+def _aggregate_key(dimension: str, value: str) -> str:
+    return f"usage:agg:{dimension}:{value}"
+
+
+def record_usage(redis_client, entries: list):
+    """
+    Appends entries to the ledger stream and updates the per document / model / day aggregates.
+    Meant to run as a background task, after the response has been sent; failures are only logged.
+    """
+    if not entries:
+        return
+    try:
+        pipe = redis_client.pipeline(transaction=False)
+        for entry in entries:
+            pipe.xadd(LEDGER_STREAM, {key: str(value) for key, value in entry.items()},
+                      maxlen=LEDGER_MAX_ENTRIES, approximate=True)
+            for dimension in AGGREGATE_DIMENSIONS:
+                key = _aggregate_key(dimension, entry[dimension])
+                pipe.sadd(f"usage:agg:{dimension}", entry[dimension])
+                pipe.hincrby(key, "requests", 1)
+                pipe.hincrby(key, "cache_hits", entry["cache_hit"])
+                for field in ("input_tokens", "cached_input_tokens", "output_tokens"):
+                    pipe.hincrby(key, field, entry[field])
+                for field in ("cost", "saved_response_cache", "saved_prompt_cache"):
+                    pipe.hincrbyfloat(key, field, entry[field])
+        pipe.execute()
+    except Exception as e:
+        logging.error(f"Failed to record usage: {e}")
+
+
+def usage_summary(redis_client, group_by: str) -> dict:
+    """Returns the aggregates for every document, model or day: {value: {requests, cost, saved_..., ...}}."""
+    values = sorted(redis_client.smembers(f"usage:agg:{group_by}"))
+    pipe = redis_client.pipeline(transaction=False)
+    for value in values:
+        pipe.hgetall(_aggregate_key(group_by, value))
+    summary = {}
+    for value, raw in zip(values, pipe.execute()):
+        summary[value] = {
+            field: (float(raw.get(field, 0)) if field in ("cost", "saved_response_cache", "saved_prompt_cache")
+                    else int(raw.get(field, 0)))
+            for field in AGGREGATE_FIELDS
+        }
+    return summary
+
+
+def read_ledger(redis_client, count: int = 100) -> list:
+    """Most recent raw ledger entries, newest first."""
+    return [{"id": entry_id, **fields} for entry_id, fields in redis_client.xrevrange(LEDGER_STREAM, count=count)]
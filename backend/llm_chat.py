@@ -1,12 +1,17 @@
 import os
-import tiktoken
-import litellm
 from dotenv import load_dotenv
-import google.generativeai as genai
-from openai import OpenAI
-import anthropic
 import re
+import json
 import logging
+import hashlib
+import itertools
+import datetime
+from functools import lru_cache
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from llm_router import route_request
+from cost_ledger import compute_cost, MODEL_PRICING
  
 # Load API keys from .env file
 load_dotenv()
@@ -22,17 +27,52 @@ logging.basicConfig(
     format="%(asctime)s - %(levelname)s - %(message)s",  # ✅ Log format
 )
 
-# Configure LiteLLM for OpenAI (GPT-4o Mini)
-litellm.api_key = OPENAI_API_KEY
-litellm.verbose = True  # ✅ Correct way to enable logging
-litellm.monitoring = "athina"  # ✅ Enable Athina tracking
-
 # ✅ Log token usage for every request
 def log_token_usage(model: str, tokens_used: int, cost: float):
     logging.info(f"Model: {model} | Tokens Used: {tokens_used} | Cost: ${cost:.6f}")
 
-# Configure DeepSeek API client
-deepseek_client = OpenAI(api_key=DEEPSEEK_API_KEY, base_url="https://api.deepseek.com")
+
+########################################
+#     Provider SDKs (loaded lazily)    #
+########################################
+# The SDKs take seconds to import, so each one is imported and configured on first use of its provider.
+@lru_cache(maxsize=None)
+def get_litellm():
+    """LiteLLM, configured for OpenAI (GPT-4o Mini)."""
+    import litellm
+    litellm.api_key = OPENAI_API_KEY
+    litellm.verbose = True  # ✅ Correct way to enable logging
+    litellm.monitoring = "athina"  # ✅ Enable Athina tracking
+    return litellm
+
+
+@lru_cache(maxsize=None)
+def get_genai():
+    """Google Generative AI SDK, configured for Gemini."""
+    import google.generativeai as genai
+    genai.configure(api_key=GOOGLE_API_KEY)
+    return genai
+
+
+@lru_cache(maxsize=None)
+def get_deepseek_client():
+    """OpenAI-compatible client for the DeepSeek API."""
+    from openai import OpenAI
+    return OpenAI(api_key=DEEPSEEK_API_KEY, base_url="https://api.deepseek.com")
+
+
+@lru_cache(maxsize=None)
+def get_claude_client():
+    """Anthropic client for Claude."""
+    import anthropic
+    return anthropic.Anthropic(api_key=CLAUDE_API_KEY)
+
+
+@lru_cache(maxsize=None)
+def get_encoding(model: str):
+    """tiktoken encoding for a model (loading an encoding is slow, so it is cached)."""
+    import tiktoken
+    return tiktoken.encoding_for_model(model)
  
  
 def count_tokens(text: str, model: str) -> int:
@@ -44,14 +84,29 @@ def count_tokens(text: str, model: str) -> int:
         if model in ["gemini flash free", "claude-3.5 haiku"]:
             return len(text.split())
         else:
-            encoding = tiktoken.encoding_for_model(model)
+            encoding = get_encoding(model)
             return len(encoding.encode(text))
     except Exception as e:
         print(f"Token count error: {e}")
         return 0
+
+
+# Tokenizer used to estimate each provider's prompt size (DeepSeek has no tiktoken encoding)
+TOKEN_COUNT_MODELS = {
+    "gpt-4o mini": "gpt-4o",
+    "gemini flash free": "gemini flash free",
+    "deepseek chat": "gpt-4o",
+    "claude-3.5 haiku": "claude-3.5 haiku",
+}
+MAX_OUTPUT_TOKENS = 1024
+
+
+def estimate_tokens(provider: str, prompt_text: str, max_tokens: int = MAX_OUTPUT_TOKENS) -> int:
+    """Estimates the tokens a call will use (prompt + max output), for the provider rate limits."""
+    return count_tokens(prompt_text, model=TOKEN_COUNT_MODELS.get(provider, "gpt-4o")) + max_tokens
  
  
-def summarize_markdown(markdown_text: str) -> str:
+def summarize_markdown(markdown_text: str, limiter=None) -> dict:
     """
     Extracts a summary from the Markdown file by:
     - Identifying key sections (Abstract, Introduction, Summary)
@@ -82,20 +137,33 @@ def summarize_markdown(markdown_text: str) -> str:
     # Use LLM for better summarization
     prompt = f"Summarize the following document content in 3-4 sentences:\n\n{summary}"
     
-    response = litellm.completion(
-        model="gpt-4o",  # Use GPT-4o Mini
-        messages=[{"role": "user", "content": prompt}]
-    )
-    return f"📝 **Summary:** {response['choices'][0]['message']['content']}"
+    with limiter.provider_slot("gpt-4o mini", estimate_tokens("gpt-4o mini", prompt)) if limiter else nullcontext():
+        response = get_litellm().completion(
+            model=MODEL_PRICING["gpt-4o mini"]["model"],  # Use GPT-4o Mini
+            messages=[{"role": "user", "content": prompt}]
+        )
+    usage = response.get("usage", {})
+    input_tokens = usage.get("prompt_tokens", 0)
+    output_tokens = usage.get("completion_tokens", 0)
+    return {
+        "response": f"📝 **Summary:** {response['choices'][0]['message']['content']}",
+        "model": "gpt-4o mini",
+        "input_tokens": input_tokens,
+        "output_tokens": output_tokens,
+        "tokens_used": input_tokens + output_tokens,
+        "cost": compute_cost("gpt-4o mini", input_tokens, output_tokens)
+    }
  
  
  
-def build_prompt(pdf_data: dict, question: str) -> str:
+def build_document_context(pdf_data: dict) -> str:
     """
-    Constructs a prompt using the extracted PDF content and the user's question.
+    Constructs the static part of the prompt (instructions + document content).
+    It is identical for every question about the same document, so it is sent first
+    and marked as cacheable where the provider supports prompt caching.
     """
     return f"""
-You are a helpful assistant. Use the following document content to answer the question.
+You are a helpful assistant. Use the following document content to answer the user's questions.
 
 Document Content:
 {pdf_data.get("pdf_content", "No document content available.")}
@@ -103,172 +171,503 @@ Document Content:
 Tables Extracted:
 {pdf_data.get("tables", "No tables available.")}
  
-User Question:
-{question}
- 
-Answer the question based solely on the document above.
+Answer the questions based solely on the document above.
 """
- 
- 
-import os
-import logging
-import litellm
-import google.generativeai as genai
-from openai import OpenAI
-import anthropic
 
-# ✅ Configure Logging
-logging.basicConfig(
-    filename="token_usage.log",
-    level=logging.INFO,
-    format="%(asctime)s - %(levelname)s - %(message)s",
-)
 
-# ✅ Function to Log Token Usage
-def log_token_usage(model: str, tokens_used: int, cost: float):
-    logging.info(f"Model: {model} | Tokens Used: {tokens_used} | Cost: ${cost:.6f}")
+def build_chat_messages(question: str, history: dict | None = None) -> list:
+    """
+    Constructs the per-turn messages: a summary of older turns (if any),
+    the recent turns of the session and the new question.
+    """
+    history = history or {}
+    messages = []
+    if history.get("summary"):
+        messages.append({"role": "user", "content": f"Summary of our earlier conversation:\n{history['summary']}"})
+        messages.append({"role": "assistant", "content": "Understood, I will keep that context in mind."})
+    messages.extend(history.get("turns", []))
+    messages.append({"role": "user", "content": question})
+    return messages
+
+
+SUMMARIZE_TURNS_TIMEOUT = 20  # Seconds; compaction is best effort and falls back to an extractive summary
+
 
-def get_llm_response(pdf_data: dict, question: str, llm_choice: str) -> dict:
+def summarize_turns(previous_summary: str, turns: list, limiter=None, timeout: float = SUMMARIZE_TURNS_TIMEOUT) -> dict:
     """
-    Calls the selected LLM from the 4 approved models and logs token usage.
+    Folds older chat turns into the rolling session summary using GPT-4o Mini.
+    Used by the chat session memory to keep the history bounded; returns the new summary
+    under `response` together with the call's tokens and cost.
+    """
+    transcript = "\n".join(f"{turn['role'].title()}: {turn['content']}" for turn in turns)
+    prompt = (
+        "Update the summary of a conversation about a document. Keep facts, numbers and "
+        "open questions, in at most 8 sentences.\n\n"
+        f"Current summary:\n{previous_summary or 'None'}\n\n"
+        f"New turns:\n{transcript}"
+    )
+    with limiter.provider_slot("gpt-4o mini", estimate_tokens("gpt-4o mini", prompt)) if limiter else nullcontext():
+        response = get_litellm().completion(
+            model=MODEL_PRICING["gpt-4o mini"]["model"],
+            messages=[{"role": "user", "content": prompt}],
+            timeout=timeout
+        )
+    usage = response.get("usage", {})
+    input_tokens = usage.get("prompt_tokens", 0)
+    output_tokens = usage.get("completion_tokens", 0)
+    return {
+        "response": response["choices"][0]["message"]["content"],
+        "model": "gpt-4o mini",
+        "input_tokens": input_tokens,
+        "output_tokens": output_tokens,
+        "tokens_used": input_tokens + output_tokens,
+        "cost": compute_cost("gpt-4o mini", input_tokens, output_tokens)
+    }
+
+
+# Gemini context caching (only available for pinned model versions and large prompts)
+GEMINI_MODEL = "gemini-1.5-pro-002"
+GEMINI_CACHE_MIN_TOKENS = 32768
+GEMINI_CACHE_TTL = datetime.timedelta(hours=1)
+_gemini_context_cache = {}  # document hash -> (cached content name, expiry time)
+
+
+def get_gemini_model(document_context: str):
+    """
+    Returns a Gemini model with the document as its context. Large documents are stored
+    as Gemini cached content so follow-up questions only pay for the new tokens.
     """
-    prompt_text = build_prompt(pdf_data, question)
-    llm_choice = llm_choice.strip().lower()  # Normalize input
+    genai = get_genai()
+    if count_tokens(document_context, model="gemini flash free") < GEMINI_CACHE_MIN_TOKENS:
+        return genai.GenerativeModel(GEMINI_MODEL, system_instruction=document_context)
 
+    from google.generativeai import caching
+
+    doc_hash = hashlib.sha256(document_context.encode("utf-8")).hexdigest()
     try:
-        if llm_choice == "gpt-4o mini":
-            response = litellm.completion(
-                model="gpt-4o",
-                messages=[{"role": "user", "content": prompt_text}]
+        cached = _gemini_context_cache.get(doc_hash)
+        if cached and cached[1] > datetime.datetime.now():
+            cached_content = caching.CachedContent.get(cached[0])
+        else:
+            cached_content = caching.CachedContent.create(
+                model=GEMINI_MODEL,
+                display_name=f"doc-{doc_hash[:16]}",
+                system_instruction=document_context,
+                ttl=GEMINI_CACHE_TTL,
             )
+            # Refresh a bit before Gemini expires the cache
+            expires_at = datetime.datetime.now() + GEMINI_CACHE_TTL - datetime.timedelta(minutes=5)
+            _gemini_context_cache[doc_hash] = (cached_content.name, expires_at)
+        return genai.GenerativeModel.from_cached_content(cached_content=cached_content)
+    except Exception as e:
+        logging.warning(f"Gemini context caching unavailable, sending full document: {e}")
+        _gemini_context_cache.pop(doc_hash, None)
+        return genai.GenerativeModel(GEMINI_MODEL, system_instruction=document_context)
+ 
+ 
+########################################
+#       Provider Calls (one per LLM)   #
+########################################
+# Each call raises on failure so the router can fall back to another provider.
+def call_gpt4o_mini(document_context: str, chat_messages: list, timeout: float,
+                    max_tokens: int = MAX_OUTPUT_TOKENS) -> dict:
+    # OpenAI caches repeated prompt prefixes automatically, so the document goes first
+    response = get_litellm().completion(
+        model=MODEL_PRICING["gpt-4o mini"]["model"],
+        messages=[{"role": "system", "content": document_context}] + chat_messages,
+        max_tokens=max_tokens,
+        timeout=timeout
+    )
 
-            # ✅ Debug: Log Raw Response
-            logging.info(f"GPT-4o Response: {response}")
-
-            # ✅ Extract Token Usage & Cost Calculation
-            usage = response.get("usage", {})
-            input_tokens = usage.get("prompt_tokens", 0)  # Input Tokens
-            output_tokens = usage.get("completion_tokens", 0)  # Output Tokens
-            total_tokens = usage.get("total_tokens", 0)
-
-            # ✅ Cost Calculation (GPT-4o Mini)
-            input_cost = input_tokens * 0.00000015
-            output_cost = output_tokens * 0.0000006
-            total_cost = input_cost + output_cost
-
-            # ✅ Log Token Usage
-            log_token_usage("GPT-4o Mini", total_tokens, total_cost)
-
-            return {
-                "response": response["choices"][0]["message"]["content"],
-                "input_tokens": input_tokens,
-                "output_tokens": output_tokens,
-                "total_tokens": total_tokens,
-                "cost": total_cost
-            }
-
-        elif llm_choice == "gemini flash free":
-            token_count = count_tokens(prompt_text, model="gemini-1.5-pro-latest")
-
-            genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
-            model = genai.GenerativeModel('gemini-1.5-pro-latest')
-            response = model.generate_content(prompt_text)
-
-            # ✅ Debug: Log Raw Response
-            logging.info(f"Gemini Response: {response}")
-
-            # ✅ Extract Token Usage
-            prompt_tokens = response.result.usage_metadata["prompt_token_count"]
-            output_tokens = response.result.usage_metadata["candidates_token_count"]
-            total_tokens = response.result.usage_metadata["total_token_count"]
-
-            # ✅ Cost Calculation (Gemini)
-            cost = total_tokens * 0.000002  # Adjust this value based on pricing
-
-            # ✅ Log Token Usage
-            log_token_usage("Gemini Flash Free", total_tokens, cost)
-
-            return {
-                "response": response.text,
-                "input_tokens": prompt_tokens,
-                "output_tokens": output_tokens,
-                "total_tokens": total_tokens,
-                "cost": cost
-            }
-
-        elif llm_choice == "deepseek chat":
-            token_count = count_tokens(prompt_text, model="deepseek-chat")
-
-            response = OpenAI(
-                api_key=os.getenv("DEEPSEEK_API_KEY"),
-                base_url="https://api.deepseek.com"
-            ).chat.completions.create(
-                model="deepseek-chat",
-                messages=[{"role": "user", "content": prompt_text}],
-                stream=False
-            )
+    # ✅ Debug: Log Raw Response
+    logging.info(f"GPT-4o Mini Response: {response}")
+
+    # ✅ Extract Token Usage & Cost Calculation
+    usage = response.get("usage", {})
+    input_tokens = usage.get("prompt_tokens", 0)  # Input Tokens
+    output_tokens = usage.get("completion_tokens", 0)  # Output Tokens
+    total_tokens = usage.get("total_tokens", 0)
+    prompt_details = usage.get("prompt_tokens_details") or {}
+    cached_tokens = getattr(prompt_details, "cached_tokens", None) or 0
+
+    # ✅ Cost Calculation (GPT-4o Mini)
+    total_cost = compute_cost("gpt-4o mini", input_tokens, output_tokens, cached_tokens)
+
+    # ✅ Log Token Usage
+    log_token_usage("GPT-4o Mini", total_tokens, total_cost)
+
+    return {
+        "response": response["choices"][0]["message"]["content"],
+        "model": "gpt-4o mini",
+        "input_tokens": input_tokens,
+        "output_tokens": output_tokens,
+        "cached_input_tokens": cached_tokens,
+        "tokens_used": total_tokens,
+        "cost": total_cost
+    }
+
+
+def call_gemini(document_context: str, chat_messages: list, timeout: float,
+                max_tokens: int = MAX_OUTPUT_TOKENS) -> dict:
+    model = get_gemini_model(document_context)
+    contents = [
+        {"role": "model" if message["role"] == "assistant" else "user", "parts": [message["content"]]}
+        for message in chat_messages
+    ]
+    response = model.generate_content(
+        contents,
+        generation_config={"max_output_tokens": max_tokens},
+        request_options={"timeout": timeout}
+    )
 
-            # ✅ Debug: Log Raw Response
-            logging.info(f"DeepSeek Response: {response}")
+    # ✅ Debug: Log Raw Response
+    logging.info(f"Gemini Response: {response}")
+
+    # ✅ Extract Token Usage
+    usage = response.usage_metadata
+    prompt_tokens = usage.prompt_token_count
+    output_tokens = usage.candidates_token_count
+    total_tokens = usage.total_token_count
+    cached_tokens = getattr(usage, "cached_content_token_count", 0) or 0
+
+    # ✅ Cost Calculation (Gemini)
+    cost = compute_cost("gemini flash free", prompt_tokens, output_tokens, cached_tokens)
+
+    # ✅ Log Token Usage
+    log_token_usage("Gemini Flash Free", total_tokens, cost)
+
+    return {
+        "response": response.text,
+        "model": "gemini flash free",
+        "input_tokens": prompt_tokens,
+        "output_tokens": output_tokens,
+        "cached_input_tokens": cached_tokens,
+        "tokens_used": total_tokens,
+        "cost": cost
+    }
+
+
+def call_deepseek(document_context: str, chat_messages: list, timeout: float,
+                  max_tokens: int = MAX_OUTPUT_TOKENS) -> dict:
+    # DeepSeek caches repeated prompt prefixes on disk automatically
+    response = get_deepseek_client().chat.completions.create(
+        model="deepseek-chat",
+        messages=[{"role": "system", "content": document_context}] + chat_messages,
+        stream=False,
+        max_tokens=max_tokens,
+        timeout=timeout
+    )
 
-            # ✅ Extract Tokens & Cost
-            usage = getattr(response, "usage", None)
-            tokens_used = getattr(usage, "total_tokens", token_count) if usage else token_count
-            cost = getattr(usage, "total_cost", token_count * 0.000002) if usage else token_count * 0.000002
+    # ✅ Debug: Log Raw Response
+    logging.info(f"DeepSeek Response: {response}")
+
+    # ✅ Extract Tokens & Cost
+    usage = response.usage
+    input_tokens = usage.prompt_tokens
+    output_tokens = usage.completion_tokens
+    cached_tokens = getattr(usage, "prompt_cache_hit_tokens", 0) or 0
+    cost = compute_cost("deepseek chat", input_tokens, output_tokens, cached_tokens)
+
+    # ✅ Log Token Usage
+    log_token_usage("DeepSeek Chat", usage.total_tokens, cost)
+
+    return {
+        "response": response.choices[0].message.content,
+        "model": "deepseek chat",
+        "input_tokens": input_tokens,
+        "output_tokens": output_tokens,
+        "cached_input_tokens": cached_tokens,
+        "tokens_used": usage.total_tokens,
+        "cost": cost
+    }
+
+
+def call_claude(document_context: str, chat_messages: list, timeout: float,
+                max_tokens: int = MAX_OUTPUT_TOKENS) -> dict:
+    # Mark the document block with cache_control so follow-up turns read it from the prompt cache
+    response = get_claude_client().messages.create(
+        model="claude-3-5-haiku-20241022",
+        max_tokens=max_tokens,
+        system=[{"type": "text", "text": document_context, "cache_control": {"type": "ephemeral"}}],
+        messages=chat_messages,
+        timeout=timeout
+    )
 
-            # ✅ Log Token Usage
-            log_token_usage("DeepSeek Chat", tokens_used, cost)
+    # ✅ Debug: Log Raw Response
+    logging.info(f"Claude Response: {response}")
+
+    # ✅ Extract Tokens & Cost (Claude reports cache reads / writes separately from input_tokens)
+    usage = response.usage
+    cached_tokens = getattr(usage, "cache_read_input_tokens", 0) or 0
+    cache_write_tokens = getattr(usage, "cache_creation_input_tokens", 0) or 0
+    input_tokens = usage.input_tokens + cached_tokens + cache_write_tokens
+    output_tokens = usage.output_tokens
+    cost = compute_cost("claude-3.5 haiku", input_tokens, output_tokens, cached_tokens, cache_write_tokens)
+
+    # ✅ Log Token Usage
+    log_token_usage("Claude-3.5 Haiku", input_tokens + output_tokens, cost)
+
+    return {
+        "response": "".join(block.text for block in response.content if block.type == "text"),
+        "model": "claude-3.5 haiku",
+        "input_tokens": input_tokens,
+        "output_tokens": output_tokens,
+        "cached_input_tokens": cached_tokens,
+        "tokens_used": input_tokens + output_tokens,
+        "cost": cost
+    }
+
+
+# The 4 approved models: call function + the API key that must be set for it to be routable
+LLM_PROVIDERS = {
+    "gpt-4o mini": {"call": call_gpt4o_mini, "api_key_env": "OPENAI_API_KEY"},
+    "gemini flash free": {"call": call_gemini, "api_key_env": "GOOGLE_API_KEY"},
+    "deepseek chat": {"call": call_deepseek, "api_key_env": "DEEPSEEK_API_KEY"},
+    "claude-3.5 haiku": {"call": call_claude, "api_key_env": "CLAUDE_API_KEY"},
+}
+LLM_ALIASES = {"deepseek": "deepseek chat"}  # Names used by the Streamlit UI
+
+# Fallback candidates, in preference order (comma separated LLM choices)
+LLM_FALLBACK_ORDER = [
+    choice.strip().lower()
+    for choice in os.getenv("LLM_FALLBACK_ORDER", ",".join(LLM_PROVIDERS)).split(",")
+    if choice.strip().lower() in LLM_PROVIDERS
+]
+
+
+def normalize_llm_choice(llm_choice: str) -> str:
+    """Maps a UI label to one of the approved providers. Raises ValueError for unknown choices."""
+    choice = llm_choice.strip().lower()
+    choice = LLM_ALIASES.get(choice, choice)
+    if choice not in LLM_PROVIDERS:
+        raise ValueError(f"LLM choice '{llm_choice}' not recognized.")
+    return choice
+
+
+def configured_providers() -> list:
+    """Fallback candidates that have an API key configured."""
+    return [choice for choice in LLM_FALLBACK_ORDER if os.getenv(LLM_PROVIDERS[choice]["api_key_env"])]
+
+
+def get_llm_response(pdf_data: dict, question: str, llm_choice: str, history: dict | None = None,
+                     hedge: bool | None = None, limiter=None, on_discarded=None) -> dict:
+    """
+    Calls the selected LLM from the 4 approved models and logs token usage.
+    The document is sent as a static prefix (cacheable), followed by the session history and the question.
+    Requests go through the router, which falls back to other configured models on timeouts / 5xx
+    and adds its decisions under the `routing` key. Raises `LLMRoutingError` if every provider fails.
+    With a `limiter`, each provider call first waits for that provider's rate limits and concurrency cap.
+    `on_discarded(answer)` receives answers that were paid for but not used (lost hedges, late timeouts).
+    """
+    document_context = build_document_context(pdf_data)
+    chat_messages = build_chat_messages(question, history)
+    return routed_llm_call(document_context, chat_messages, normalize_llm_choice(llm_choice), hedge=hedge,
+                           limiter=limiter, on_discarded=on_discarded)
 
-            return {
-                "response": response.choices[0].message.content,
-                "tokens_used": tokens_used,
-                "cost": cost
-            }
 
-        elif llm_choice == "claude-3.5 haiku":
-            token_count = count_tokens(prompt_text, model="claude-3-5-haiku-20241022")
+def routed_llm_call(document_context: str, chat_messages: list, llm_choice: str, hedge: bool | None = None,
+                    limiter=None, max_tokens: int = MAX_OUTPUT_TOKENS, on_discarded=None) -> dict:
+    """Sends one prompt through the router (and the rate limiter, if given) and returns the answer dict."""
+    prompt_text = document_context + "".join(message["content"] for message in chat_messages)
 
-            client = anthropic.Anthropic(api_key=os.getenv("CLAUDE_API_KEY"))
-            response = client.messages.create(
-                model="claude-3-5-haiku-20241022",
-                max_tokens=1024,
-                messages=[{"role": "user", "content": prompt_text}]
-            )
+    def call(provider: str, timeout: float) -> dict:
+        return LLM_PROVIDERS[provider]["call"](document_context, chat_messages, timeout, max_tokens=max_tokens)
 
-            # ✅ Debug: Log Raw Response
-            logging.info(f"Claude Response: {response}")
+    def acquire(provider: str):
+        # Taken outside the router's timing, so our own limits never count as provider latency or failures
+        return limiter.provider_slot(provider, estimate_tokens(provider, prompt_text, max_tokens))
 
-            # ✅ Approximate Cost Calculation
-            cost = token_count * 0.000003  # Assume $3 per 1M tokens
+    answer, routing = route_request(llm_choice, configured_providers(), call, hedge=hedge,
+                                    acquire=acquire if limiter else None, on_discarded=on_discarded)
+    answer["routing"] = routing
+    return answer
 
-            # ✅ Log Token Usage
-            log_token_usage("Claude-3.5 Haiku", token_count, cost)
 
-            return {
-                "response": response.content,
-                "tokens_used": token_count,
-                "cost": cost
-            }
+ 
+ 
+########################################
+#     Batch Questions (one document)   #
+########################################
+BATCH_ANSWER_TOKENS = 256  # Output budget per question in a multi-question prompt
+BATCH_MAX_OUTPUT_TOKENS = 4096  # Output budget per multi-question prompt
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "4"))  # Packed prompts in flight per batch
+PROVIDER_CONTEXT_TOKENS = {
+    "gpt-4o mini": 128000,
+    "gemini flash free": 1000000,
+    "deepseek chat": 64000,
+    "claude-3.5 haiku": 200000,
+}
+
+
+def build_batch_question(questions: list) -> str:
+    """Constructs one user message asking several numbered questions, answered as a JSON object."""
+    numbered = "\n".join(f"{number}. {question}" for number, question in enumerate(questions, 1))
+    return (
+        "Answer each of the following questions based solely on the document. "
+        "Reply with only a JSON object that maps each question number to its answer, "
+        'for example {"1": "...", "2": "..."}.\n\n'
+        f"{numbered}"
+    )
 
-        else:
-            return {"response": f"⚠️ LLM choice '{llm_choice}' not recognized.", "tokens_used": 0, "cost": 0.0}
 
-    except Exception as e:
-        logging.error(f"Error processing LLM request: {e}")
-        return {"response": f"Error: {e}", "tokens_used": 0, "cost": 0.0}
+def parse_batch_answers(text: str, count: int) -> dict:
+    """Parses the JSON reply of a multi-question prompt into {question position: answer}."""
+    start, end = text.find("{"), text.rfind("}")
+    if start == -1 or end <= start:
+        return {}
+    try:
+        data = json.loads(text[start:end + 1])
+    except json.JSONDecodeError:
+        return {}
+    answers = {}
+    for key, value in data.items():
+        if str(key).strip().isdigit() and 1 <= int(key) <= count and value:
+            answers[int(key) - 1] = value if isinstance(value, str) else json.dumps(value)
+    return answers
 
 
+def pack_questions(document_context: str, questions: list, provider: str) -> list:
+    """
+    Groups question indexes into as few prompts as fit the token budget: the provider's context
+    window (minus the document and output budget) and `BATCH_MAX_OUTPUT_TOKENS` for the answers.
+    """
+    token_model = TOKEN_COUNT_MODELS.get(provider, "gpt-4o")
+    input_budget = (PROVIDER_CONTEXT_TOKENS.get(provider, 32000)
+                    - count_tokens(document_context, model=token_model) - BATCH_MAX_OUTPUT_TOKENS)
+    max_per_group = BATCH_MAX_OUTPUT_TOKENS // BATCH_ANSWER_TOKENS
+
+    groups, current, used = [], [], 0
+    for index, question in enumerate(questions):
+        question_tokens = count_tokens(question, model=token_model) + 8  # Numbering / separators
+        if current and (len(current) >= max_per_group or used + question_tokens > input_budget):
+            groups.append(current)
+            current, used = [], 0
+        current.append(index)
+        used += question_tokens
+    if current:
+        groups.append(current)
+    return groups
+
+
+BATCH_USAGE_FIELDS = ("input_tokens", "cached_input_tokens", "output_tokens", "cost")
+
+
+def _answer_event(index: int, answer_text: str, answer: dict, share: int) -> dict:
+    """One per-question result; tokens and cost of a packed prompt are split evenly between its questions."""
+    return {
+        "index": index,
+        "answer": answer_text,
+        "model": answer.get("model"),
+        "input_tokens": (answer.get("input_tokens") or 0) / share,
+        "cached_input_tokens": (answer.get("cached_input_tokens") or 0) / share,
+        "output_tokens": (answer.get("output_tokens") or 0) / share,
+        "cost": (answer.get("cost") or 0.0) / share,
+        "routing": answer.get("routing"),
+        "packed_with": share,
+    }
+
+
+def _report_abandoned_group(future, on_discarded):
+    """Passes the usage of a group that finished after the batch was closed to `on_discarded`."""
+    if future.cancelled() or future.exception() is not None:
+        return
+    for event in future.result():
+        if event.get("cost") or event.get("input_tokens"):
+            on_discarded(event)
+
+
+def answer_questions_batch(pdf_data: dict, questions: list, llm_choice: str, hedge: bool | None = None, limiter=None,
+                           on_discarded=None):
+    """
+    Answers many questions about one document with as few LLM calls as possible.
+    Questions are packed into multi-question prompts (the document prefix is built once and
+    stays cacheable); answers missing from a packed reply are retried one by one.
+
+    Yields one dict per question, as soon as its group finishes:
+    `{"index", "answer", "input_tokens", "output_tokens", "cost", "routing", "packed_with"}`
+    or `{"index", "error"}` if the LLM call failed. A packed prompt is paid for by all of its
+    questions, so a retried question also carries its share of the packed call (an error event
+    then carries the usage fields too).
+    """
+    document_context = build_document_context(pdf_data)
+    llm_choice = normalize_llm_choice(llm_choice)
+
+    def ask_one(index: int) -> dict:
+        answer = routed_llm_call(document_context, build_chat_messages(questions[index]), llm_choice,
+                                 hedge=hedge, limiter=limiter, on_discarded=on_discarded)
+        return _answer_event(index, answer.get("response", ""), answer, 1)
+
+    def run_group(group: list) -> list:
+        if len(group) == 1:
+            return [ask_one(group[0])]
+
+        group_questions = [questions[index] for index in group]
+        answer = routed_llm_call(
+            document_context,
+            [{"role": "user", "content": build_batch_question(group_questions)}],
+            llm_choice,
+            hedge=hedge,
+            limiter=limiter,
+            max_tokens=min(BATCH_MAX_OUTPUT_TOKENS, len(group) * BATCH_ANSWER_TOKENS),
+            on_discarded=on_discarded,
+        )
+        parsed = parse_batch_answers(answer.get("response", ""), len(group))
+        events = [_answer_event(group[position], text, answer, len(group)) for position, text in parsed.items()]
+        for position, index in enumerate(group):
+            if position in parsed:
+                continue
+            # Spend on the packed prompt still counts when its reply had no answer for this question
+            packed_share = _answer_event(index, "", answer, len(group))
+            try:
+                event = ask_one(index)
+            except Exception as e:
+                event = {"index": index, "error": str(e), "model": packed_share["model"],
+                         **{field: 0 for field in BATCH_USAGE_FIELDS}}
+            for field in BATCH_USAGE_FIELDS:
+                event[field] += packed_share[field]
+            events.append(event)
+        return events
+
+    # Groups are submitted as earlier ones finish, so a client that disconnects stops the spending:
+    # closing this generator cancels everything not yet started
+    groups = iter(pack_questions(document_context, questions, llm_choice))
+    executor = ThreadPoolExecutor(max_workers=BATCH_CONCURRENCY)
+    futures = {}  # future -> group
+    try:
+        for group in itertools.islice(groups, BATCH_CONCURRENCY):
+            futures[executor.submit(run_group, group)] = group
+        while futures:
+            done, _ = wait(list(futures), return_when=FIRST_COMPLETED)
+            for future in done:
+                group = futures.pop(future)
+                try:
+                    events = future.result()
+                except Exception as e:
+                    logging.error(f"Batch question group failed: {e}")
+                    events = [{"index": index, "error": str(e)} for index in group]
+                next_group = next(groups, None)
+                if next_group is not None:
+                    futures[executor.submit(run_group, next_group)] = next_group
+                yield from events
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+        if on_discarded:
+            # Groups already running when the client went away are still paid for
+            for future in futures:
+                future.add_done_callback(lambda done: _report_abandoned_group(done, on_discarded))
  
  
-def process_request(pdf_data: dict, question: str, llm_choice: str | None, text_summary: bool = False) -> str:
+def process_request(pdf_data: dict, question: str, llm_choice: str | None, text_summary: bool = False,
+                    history: dict | None = None, hedge: bool | None = None, limiter=None, on_discarded=None) -> str:
     """
     Determines whether to generate a **summary** or engage in **LLM chat**.
     - If `text_summary=True`, it summarizes Markdown content.
-    - Otherwise, it passes data to an LLM.
+    - Otherwise, it passes data (and the chat session history, if any) to an LLM.
     """
     if text_summary:
-        return summarize_markdown(pdf_data["pdf_content"])
+        return summarize_markdown(pdf_data["pdf_content"], limiter=limiter)
     elif llm_choice:
-        return get_llm_response(pdf_data, question, llm_choice)
+        return get_llm_response(pdf_data, question, llm_choice, history=history, hedge=hedge, limiter=limiter,
+                                on_discarded=on_discarded)
     else:
         return "⚠️ No valid LLM choice provided."
\ No newline at end of file
@@ -0,0 +1,290 @@
+# backend/llm_router.py
+
+import os
+import time
+import logging
+import threading
+from contextlib import nullcontext
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+# Routing settings (overridable through the environment)
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "60"))  # Seconds before a provider call is abandoned
+HEDGING_ENABLED = os.getenv("LLM_HEDGING", "false").lower() in ("1", "true", "yes")
+HEDGE_DEFAULT_DELAY = 8.0  # Hedge delay used until enough latency samples exist
+HEDGE_MIN_DELAY = 1.0
+HEDGE_MIN_SAMPLES = 10
+LATENCY_WINDOW = 100  # Recent latencies kept per provider (for p95)
+OUTCOME_WINDOW = 50  # Recent outcomes kept per provider (for error rate)
+CIRCUIT_FAILURES = 3  # Consecutive failures before a provider is skipped
+CIRCUIT_COOLDOWN = 30.0  # Seconds a failing provider is skipped
+QUEUE_POLL_INTERVAL = 0.1  # Seconds between checks on a call still waiting for a router thread
+
+_executor = ThreadPoolExecutor(max_workers=int(os.getenv("LLM_ROUTER_THREADS", "16")))
+
+
+class LLMRoutingError(Exception):
+    """Raised when no provider on the route produced an answer."""
+
+    def __init__(self, message: str, attempts: list):
+        super().__init__(message)
+        self.attempts = attempts
+
+    @property
+    def retry_after(self) -> float | None:
+        """Earliest retry time if every attempt was rejected by a rate limit, else None."""
+        waits = [attempt.get("retry_after") for attempt in self.attempts]
+        if not waits or None in waits:
+            return None
+        return min(waits)
+
+
+########################################
+#        Live Provider Statistics      #
+########################################
+class ProviderStats:
+    """Rolling latency / error statistics for one provider (per worker process)."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.outcomes = deque(maxlen=OUTCOME_WINDOW)
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+
+    def record(self, success: bool, latency: float):
+        with self.lock:
+            self.outcomes.append(success)
+            if success:
+                self.latencies.append(latency)
+                self.consecutive_failures = 0
+            else:
+                self.consecutive_failures += 1
+                if self.consecutive_failures >= CIRCUIT_FAILURES:
+                    self.open_until = time.monotonic() + CIRCUIT_COOLDOWN
+
+    def error_rate(self) -> float:
+        with self.lock:
+            if not self.outcomes:
+                return 0.0
+            return 1 - sum(self.outcomes) / len(self.outcomes)
+
+    def p95(self) -> float | None:
+        with self.lock:
+            if not self.latencies:
+                return None
+            ordered = sorted(self.latencies)
+            return ordered[min(int(len(ordered) * 0.95), len(ordered) - 1)]
+
+    def hedge_delay(self) -> float:
+        """Time to wait for this provider before sending a hedged duplicate."""
+        if len(self.latencies) < HEDGE_MIN_SAMPLES:
+            return HEDGE_DEFAULT_DELAY
+        return max(self.p95(), HEDGE_MIN_DELAY)
+
+    def available(self) -> bool:
+        return time.monotonic() >= self.open_until
+
+    def snapshot(self) -> dict:
+        p95 = self.p95()
+        return {
+            "requests": len(self.outcomes),
+            "error_rate": round(self.error_rate(), 3),
+            "p95_latency_ms": round(p95 * 1000) if p95 is not None else None,
+            "available": self.available(),
+        }
+
+
+_provider_stats = {}
+_stats_lock = threading.Lock()
+
+
+def get_stats(provider: str) -> ProviderStats:
+    with _stats_lock:
+        if provider not in _provider_stats:
+            _provider_stats[provider] = ProviderStats()
+        return _provider_stats[provider]
+
+
+def provider_health() -> dict:
+    """Returns the live statistics of every provider seen by this worker."""
+    with _stats_lock:
+        providers = list(_provider_stats)
+    return {provider: get_stats(provider).snapshot() for provider in providers}
+
+
+########################################
+#            Routing Logic             #
+########################################
+def is_retryable_error(exc: Exception) -> bool:
+    """True for timeouts, connection problems, rate limits and 5xx errors (worth trying another provider)."""
+    if isinstance(exc, (TimeoutError, ConnectionError)):
+        return True
+    name = type(exc).__name__.lower()
+    if any(marker in name for marker in ("timeout", "connection", "ratelimit", "unavailable", "overloaded", "internalserver")):
+        return True
+    status = getattr(exc, "status_code", None) or getattr(exc, "code", None)
+    if isinstance(status, int):
+        return status in (408, 429) or status >= 500
+    return False
+
+
+def plan_route(requested: str, candidates: list) -> list:
+    """
+    Orders the providers to try: the requested one first, then the other candidates
+    by live error rate and p95 latency. Providers with an open circuit go last.
+    """
+    fallbacks = [provider for provider in candidates if provider != requested]
+    fallbacks.sort(key=lambda provider: (get_stats(provider).error_rate(), get_stats(provider).p95() or 0.0))
+    route = [requested] + fallbacks
+    return [p for p in route if get_stats(p).available()] + [p for p in route if not get_stats(p).available()]
+
+
+class _Attempt:
+    """One provider call made by the router. Its timeout clock starts when the call starts running."""
+
+    def __init__(self, provider: str, answered: threading.Event):
+        self.provider = provider
+        self.answered = answered  # Shared by the attempts of one request; set by the first success
+        self.submitted = time.monotonic()
+        self.started = None  # Set by the worker thread; None while the call waits for a thread or a rate limit slot
+        self.abandoned = threading.Event()
+
+    def clock_start(self) -> float:
+        return self.started if self.started is not None else self.submitted
+
+
+def _timed_call(attempt: _Attempt, call, timeout: float, acquire=None):
+    """
+    Runs one provider call and records its outcome (unless the router already gave up on it).
+    `acquire(provider)` (our own rate limits) is entered before the clock starts: waiting for it is not
+    provider latency, and a local rejection is not a provider failure.
+    """
+    if attempt.abandoned.is_set() or attempt.answered.is_set():  # Don't pay for an answer nobody reads
+        return None
+    with acquire(attempt.provider) if acquire else nullcontext():
+        if attempt.abandoned.is_set() or attempt.answered.is_set():
+            return None
+        attempt.started = time.monotonic()
+        try:
+            result = call(attempt.provider, timeout)
+        except Exception:
+            if not attempt.abandoned.is_set():
+                get_stats(attempt.provider).record(False, time.monotonic() - attempt.started)
+            raise
+    attempt.answered.set()  # Queued duplicates of this request can be skipped now
+    if not attempt.abandoned.is_set():  # A timed-out call was already recorded as a failure by the router
+        get_stats(attempt.provider).record(True, time.monotonic() - attempt.started)
+    return result
+
+
+def _report_discarded(future, on_discarded):
+    """Passes the result of an abandoned call that finished anyway (and was paid for) to `on_discarded`."""
+    if future.cancelled() or future.exception() is not None or future.result() is None:
+        return
+    try:
+        on_discarded(future.result())
+    except Exception as e:
+        logging.error(f"Failed to report a discarded LLM answer: {e}")
+
+
+def route_request(requested: str, candidates: list, call, hedge: bool | None = None, timeout: float | None = None,
+                  acquire=None, on_discarded=None):
+    """
+    Calls `call(provider, timeout)` for the requested provider and falls back along the route
+    on timeouts or retryable errors. With hedging enabled, a duplicate request is sent to the
+    next provider once the primary exceeds its p95 latency; the first answer wins.
+    `acquire(provider)`, if given, is a context manager held around each call (e.g. a rate limiter slot).
+    Time spent waiting for a free router thread or for `acquire` does not count against a provider;
+    a call that has not started after `timeout` is dropped without being sent.
+    `on_discarded(result)` is called (later, from a router thread) for every abandoned call that still
+    completed - lost hedges and calls that finished after their timeout - so their spend can be recorded.
+
+    Returns `(result, routing)` where `routing` describes every attempt.
+    Raises `LLMRoutingError` if no provider produced an answer.
+    """
+    hedge = HEDGING_ENABLED if hedge is None else hedge
+    timeout = timeout or LLM_TIMEOUT
+    queue = plan_route(requested, candidates)
+    attempts = []
+    pending = {}  # future -> _Attempt
+    hedged = False
+    answered = threading.Event()
+
+    def launch(provider):
+        attempt = _Attempt(provider, answered)
+        pending[_executor.submit(_timed_call, attempt, call, timeout, acquire)] = attempt
+
+    def abandon(future, attempt):
+        attempt.abandoned.set()
+        future.cancel()  # Never runs if it is still queued
+        if on_discarded:
+            future.add_done_callback(lambda done: _report_discarded(done, on_discarded))
+
+    def record_attempt(attempt, status, error=None):
+        entry = {"provider": attempt.provider, "status": status,
+                 "latency_ms": round((time.monotonic() - attempt.clock_start()) * 1000)}
+        if error:
+            entry["error"] = str(error)
+            if getattr(error, "retry_after", None) is not None:
+                entry["retry_after"] = error.retry_after
+        attempts.append(entry)
+
+    launch(queue.pop(0))
+    while pending:
+        now = time.monotonic()
+        deadline = min(attempt.clock_start() + timeout for attempt in pending.values())
+        wait_for = max(deadline - now, 0)
+        can_hedge = hedge and not hedged and queue and len(pending) == 1
+        if can_hedge:
+            primary = next(iter(pending.values()))
+            if primary.started is not None:
+                wait_for = min(wait_for, max(primary.started + get_stats(primary.provider).hedge_delay() - now, 0))
+            else:
+                wait_for = min(wait_for, QUEUE_POLL_INTERVAL)  # Hedge delay counts from when the primary starts
+
+        done, _ = wait(list(pending), timeout=wait_for, return_when=FIRST_COMPLETED)
+
+        for future in done:
+            attempt = pending.pop(future)
+            try:
+                result = future.result()
+            except Exception as e:
+                record_attempt(attempt, "error", e)
+                logging.warning(f"LLM provider '{attempt.provider}' failed: {e}")
+                if not is_retryable_error(e):
+                    # A bad request fails the same way everywhere, so stop unless a hedge is still running
+                    queue.clear()
+                continue
+
+            record_attempt(attempt, "ok")
+            for other_future, other in pending.items():
+                abandon(other_future, other)
+                record_attempt(other, "hedge_lost")
+            return result, {
+                "requested": requested,
+                "served_by": attempt.provider,
+                "fallback": attempt.provider != requested,
+                "hedged": hedged,
+                "attempts": attempts,
+            }
+
+        # Abandon calls that ran past the timeout (or never got a thread)
+        now = time.monotonic()
+        for future, attempt in list(pending.items()):
+            if now - attempt.clock_start() >= timeout:
+                abandon(future, attempt)
+                if attempt.started is not None:
+                    get_stats(attempt.provider).record(False, now - attempt.started)
+                    record_attempt(attempt, "timeout")
+                else:
+                    record_attempt(attempt, "queue_timeout")  # Never reached the provider
+                del pending[future]
+
+        if not pending and queue:
+            launch(queue.pop(0))
+        elif not done and can_hedge and len(pending) == 1 and next(iter(pending.values())).started is not None:
+            hedged = True
+            launch(queue.pop(0))
+
+    raise LLMRoutingError(f"All LLM providers failed for '{requested}'.", attempts)
@@ -1,41 +1,56 @@
 import os
 import json
 import redis
-import boto3
-import uvicorn
-import re
-import urllib.parse  # Ensure proper URL encoding
-from fastapi import FastAPI, HTTPException, UploadFile, File
-from fastapi.responses import JSONResponse
+import math
+from functools import partial
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, UploadFile, File, Request, BackgroundTasks
+from fastapi.responses import JSONResponse, StreamingResponse, Response
+from fastapi.staticfiles import StaticFiles
+from starlette.background import BackgroundTask
 from pydantic import BaseModel
 from dotenv import load_dotenv
  
-from pdf_markdown_convertor import pdf_to_markdown_s3
-from llm_chat import process_request  # Using process_request for both Summary & LLM Chat
+from pdf_markdown_convertor import pdf_to_markdown_s3, clean_pdf_name
+from storage import get_storage, LocalStorage, WriteThroughStorage, LOCAL_FILES_ROUTE
+from llm_chat import process_request, summarize_turns, answer_questions_batch, normalize_llm_choice  # Using process_request for both Summary & LLM Chat
+from llm_router import LLMRoutingError, provider_health
+from rate_limiter import RateLimiter, RateLimitExceeded
+from chat_memory import (create_session, load_session, delete_session, get_history, append_turn,
+                         compact_stored_session, NEW_SESSION)
+from cost_ledger import usage_entry, record_usage, usage_summary, read_ledger, AGGREGATE_DIMENSIONS
  
 # Load environment variables
 load_dotenv()
 
-# AWS S3 Configuration
-AWS_ACCESS_KEY_ID = os.getenv("AWS_ACCESS_KEY_ID")  
-AWS_SECRET_ACCESS_KEY = os.getenv("AWS_SECRET_ACCESS_KEY")
-AWS_DEFAULT_REGION = os.getenv("AWS_DEFAULT_REGION")  
-S3_BUCKET_NAME = os.getenv("S3_BUCKET_NAME")  
-S3_BUCKET_ENDPOINT = f"https://{S3_BUCKET_NAME}.s3.{AWS_DEFAULT_REGION}.amazonaws.com"
+# Storage for PDFs, Markdown and images: STORAGE_BACKEND=s3 (default), local or write_through
+storage = get_storage()
+
+# Hosts allowed to name the end user with X-User-Id (the Streamlit app runs next to the API by default)
+TRUSTED_PROXIES = {host.strip() for host in os.getenv("TRUSTED_PROXY_IPS", "127.0.0.1,::1").split(",") if host.strip()}
  
-# Initialize FastAPI
-app = FastAPI()
+# Clients are created in the lifespan hook (not at import) to keep worker start-up fast
+redis_client = None
+rate_limiter = None
  
-# Initialize Redis (Local)
-redis_client = redis.Redis(host="localhost", port=6379, db=0, decode_responses=True)
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Creates the Redis and rate limiter clients when the worker starts and closes them on shutdown."""
+    global redis_client, rate_limiter
+    # Initialize Redis (Local)
+    redis_client = redis.Redis(host="localhost", port=6379, db=0, decode_responses=True)
+    # Rate limits for outbound LLM calls (shared by all workers through Redis)
+    rate_limiter = RateLimiter(redis_client)
+    yield
+    redis_client.close()
  
-# Initialize S3 Client
-s3_client = boto3.client(
-    "s3",
-    aws_access_key_id=AWS_ACCESS_KEY_ID,
-    aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
-    region_name=AWS_DEFAULT_REGION,
-)
+# Initialize FastAPI
+app = FastAPI(lifespan=lifespan)
+
+# Local files (images linked from the Markdown) are served by the API itself
+local_storage = storage.local if isinstance(storage, WriteThroughStorage) else storage
+if isinstance(local_storage, LocalStorage):
+    app.mount(LOCAL_FILES_ROUTE, StaticFiles(directory=local_storage.root), name="files")
  
 ########################################
 #           Pydantic Models            #
@@ -51,10 +66,25 @@ class ChatRequest(BaseModel):
     markdown_filename: str | None = None
     llm_choice: str | None = None  # Optional if text_summary=True
     text_summary: bool = False  # Flag to differentiate between summary & chat
+    session_id: str | None = None  # Chat session for follow-up questions ("new" starts one; None is stateless)
+    hedge: bool | None = None  # Send a hedged duplicate to a fallback LLM (defaults to LLM_HEDGING)
+ 
+class BatchChatRequest(BaseModel):
+    pdf_name: str
+    questions: list[str]
+    llm_choice: str
+    markdown_filename: str | None = None
+    pdf_json: str | None = None
+    hedge: bool | None = None
  
 ########################################
 #         Redis Cache Utility          #
 ########################################
+def chat_cache_key(pdf_name: str, question: str, text_summary: bool, llm_choice: str | None) -> str:
+    """Cache key of a single-turn answer, unique per document, question, mode and LLM model."""
+    return f"{pdf_name}:{question}:{text_summary}:{llm_choice}"
+ 
+
 def get_cached_response(key: str):
     """Retrieve response from Redis cache and convert JSON string back to dictionary."""
     cached_value = redis_client.get(key)
@@ -63,47 +93,112 @@ def get_cached_response(key: str):
     return None  # Return None if key doesn't exist
  
 
+def get_cached_responses(keys: list) -> list:
+    """Retrieve many cached responses in one round-trip (None for missing keys)."""
+    if not keys:
+        return []
+    return [json.loads(value) if value else None for value in redis_client.mget(keys)]
+ 
+
 def set_cached_response(key: str, value: dict, ttl: int = 86400):
     """Store response in Redis as a JSON string with a TTL (default: 24 hours)."""
     redis_client.setex(key, ttl, json.dumps(value))  # ✅ Convert dictionary to JSON string
 
- 
+
+########################################
+#          Rate Limit Utility          #
+########################################
+def get_caller_id(http_request: Request) -> str:
+    """
+    Identifies the caller for per-user rate limits: the client IP, or the X-User-Id header when the
+    request comes from a trusted proxy (e.g. the Streamlit app, which sends one id per browser session).
+    """
+    client_host = http_request.client.host if http_request.client else None
+    user_id = http_request.headers.get("x-user-id")
+    if user_id and client_host in TRUSTED_PROXIES:
+        return f"user:{user_id}"
+    return client_host or "anonymous"
+
+
+def rate_limited(retry_after: float, detail) -> HTTPException:
+    """Builds a 429 response with a Retry-After header (in whole seconds)."""
+    return HTTPException(status_code=429, detail=detail, headers={"Retry-After": str(max(math.ceil(retry_after), 1))})
+
+
+def discarded_usage_recorder(kind: str, pdf_name: str):
+    """
+    Callback for answers the router paid for but threw away (lost hedges, calls that finished after
+    their timeout). It runs after the response was sent, so it writes to the cost ledger directly.
+    """
+    return lambda answer: record_usage(redis_client, [usage_entry(f"{kind}_discarded", pdf_name, answer)])
+
+
 ########################################
-#         S3 Utility Functions         #
+#        Chat Session Utility          #
 ########################################
-def clean_pdf_name(filename: str) -> str:
-    """Cleans the PDF filename by removing unwanted characters like (1), spaces, and file extensions."""
-    filename = os.path.splitext(filename)[0]  # Remove extension
-    filename = re.sub(r"[^a-zA-Z0-9_-]", "_", filename)  # Replace spaces & special chars
-    return filename.strip("_")  # Remove trailing underscores
+def remember_turn(session_id: str, session: dict, question: str, answer_text: str, pdf_name: str,
+                  background_tasks: BackgroundTasks):
+    """Adds a turn to the chat session; a due history compaction runs after the response is sent."""
+    if append_turn(redis_client, session_id, session, question, answer_text):
+        background_tasks.add_task(compact_history, session_id, pdf_name)
+
+
+def compact_history(session_id: str, pdf_name: str):
+    """Background task: summarizes older turns of a session and records the spend in the cost ledger."""
+    summary_answer = compact_stored_session(redis_client, session_id,
+                                            summarizer=partial(summarize_turns, limiter=rate_limiter))
+    if summary_answer:
+        record_usage(redis_client, [usage_entry("compaction", pdf_name, summary_answer)])
+
  
+########################################
+#       Storage Utility Functions      #
+########################################
 def get_markdown_from_s3(pdf_name: str, markdown_filename: str):
-    """Fetches the content of a selected Markdown file from S3."""
+    """Fetches the content of a selected Markdown file from storage."""
     object_key = f"{pdf_name}/{markdown_filename}"
     try:
-        response = s3_client.get_object(Bucket=S3_BUCKET_NAME, Key=object_key)
-        markdown_content = response["Body"].read().decode("utf-8")
-        return markdown_content
-    except s3_client.exceptions.NoSuchKey:
+        return storage.read_text(object_key)
+    except FileNotFoundError:
         raise HTTPException(status_code=404, detail=f"Markdown file '{markdown_filename}' not found in {pdf_name}.")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching Markdown content: {e}")
  
 def list_images_from_s3(pdf_name: str):
-    """Lists image files in the 'Images/' folder of the given PDF directory in S3."""
-    image_urls = []
-    prefix = f"{pdf_name}/Images/"
+    """Lists image files in the 'Images/' folder of the given PDF directory in storage."""
     try:
-        response = s3_client.list_objects_v2(Bucket=S3_BUCKET_NAME, Prefix=prefix)
-        if "Contents" in response:
-            for obj in response["Contents"]:
-                if obj["Key"].endswith((".png", ".jpg", ".jpeg", ".gif")):
-                    encoded_url = urllib.parse.quote(obj["Key"])  # Encode special characters
-                    image_urls.append(f"{S3_BUCKET_ENDPOINT}/{encoded_url}")
-        return image_urls
+        return [storage.public_url(key) for key in storage.list_keys(f"{pdf_name}/Images/")
+                if key.endswith((".png", ".jpg", ".jpeg", ".gif"))]
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching images: {e}")
  
+def parse_byte_range(range_header: str, size: int) -> tuple[int, int]:
+    """Parses a single `Range: bytes=start-end` header into a [start, end) pair; raises 416 if unsatisfiable."""
+    try:
+        unit, _, spec = range_header.partition("=")
+        first, _, last = spec.strip().partition("-")
+        if unit.strip() != "bytes" or "," in spec:
+            raise ValueError
+        if not first:  # Suffix range: the last N bytes
+            start, end = max(size - int(last), 0), size
+        else:
+            start, end = int(first), min(int(last) + 1, size) if last else size
+    except ValueError:
+        start, end = size, size
+    if start >= end:
+        raise HTTPException(status_code=416, detail="Requested range not satisfiable.",
+                            headers={"Content-Range": f"bytes */{size}"})
+    return start, end
+ 
+def load_pdf_data(pdf_name: str, markdown_filename: str | None, pdf_json: str | None) -> dict:
+    """Loads the document to chat about: a Markdown file from S3, or extracted PDF JSON sent by the client."""
+    if markdown_filename:
+        markdown_content = get_markdown_from_s3(pdf_name, markdown_filename)
+        return {"pdf_content": markdown_content or "No content available.", "tables": []}
+    if pdf_json:
+        return json.loads(pdf_json)
+    raise HTTPException(status_code=400, detail="No valid input provided.")
+ 
 ########################################
 #            API Endpoints             #
 ########################################
@@ -111,22 +206,19 @@ def list_images_from_s3(pdf_name: str):
 def fetch_markdown_files():
     """Fetches Markdown file names grouped by their PDF folders."""
     try:
-        response = s3_client.list_objects_v2(Bucket=S3_BUCKET_NAME)
         pdf_folders = {}
  
-        if "Contents" in response:
-            for obj in response["Contents"]:
-                key = obj["Key"]
-                parts = key.split("/")
-                
-                if len(parts) > 1 and parts[-1].endswith(".md"):
-                    pdf_folder = parts[0]
-                    markdown_file = parts[-1]
+        for key in storage.list_keys():
+            parts = key.split("/")
+            
+            if len(parts) > 1 and parts[-1].endswith(".md"):
+                pdf_folder = parts[0]
+                markdown_file = parts[-1]
  
-                    if pdf_folder not in pdf_folders:
-                        pdf_folders[pdf_folder] = []
-                    
-                    pdf_folders[pdf_folder].append(markdown_file)
+                if pdf_folder not in pdf_folders:
+                    pdf_folders[pdf_folder] = []
+                
+                pdf_folders[pdf_folder].append(markdown_file)
  
         return {"markdown_files": pdf_folders}
     
@@ -139,6 +231,26 @@ def get_markdown_content(request: MarkdownRequest):
     markdown_content = get_markdown_from_s3(request.pdf_name, request.markdown_filename)
     return {"markdown_content": markdown_content}
  
+@app.get("/markdown/{pdf_name}/{markdown_filename}")
+def get_markdown_raw(pdf_name: str, markdown_filename: str, request: Request):
+    """
+    Serves a Markdown file as-is. Supports `Range: bytes=...` so clients can page through large
+    documents; with local storage only the requested slice of the memory-mapped file is read.
+    """
+    object_key = f"{pdf_name}/{markdown_filename}"
+    range_header = request.headers.get("range")
+    headers = {"Accept-Ranges": "bytes"}
+    try:
+        if not range_header:
+            return Response(storage.read_bytes(object_key), media_type="text/markdown; charset=utf-8", headers=headers)
+        size = storage.size(object_key)
+        start, end = parse_byte_range(range_header, size)
+        body = storage.read_range(object_key, start, end)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail=f"Markdown file '{markdown_filename}' not found in {pdf_name}.")
+    headers["Content-Range"] = f"bytes {start}-{end - 1}/{size}"
+    return Response(body, status_code=206, media_type="text/markdown; charset=utf-8", headers=headers)
+ 
 @app.post("/upload_pdf/")
 async def upload_pdf(file: UploadFile = File(...)):
     """
@@ -167,11 +279,13 @@ async def upload_pdf(file: UploadFile = File(...)):
         raise HTTPException(status_code=500, detail=f"Error processing PDF: {str(e)}")
  
 @app.post("/chat/")
-def chat(request: ChatRequest):
+def chat(request: ChatRequest, http_request: Request, background_tasks: BackgroundTasks):
     """
     Handles both **Text Summary** and **LLM Chat** based on `text_summary` flag.
     Uses Redis caching to store and retrieve previous responses for each LLM model.
+    Usage (or the spend saved by a cache hit) is written to the cost ledger after the response is sent.
     """
+    kind = "summary" if request.text_summary else "chat"
     try:
         # Ensure `pdf_name`, `question`, and `llm_choice` (if chat) are provided
         if not request.pdf_name or not request.question:
@@ -179,74 +293,225 @@ def chat(request: ChatRequest):
         if not request.text_summary and not request.llm_choice:
             raise HTTPException(status_code=400, detail="LLM choice is required for chat.")
 
+        # ✅ Load (or start, if the client asks for one) the chat session; summaries are always stateless
+        session_id, session = None, None
+        if not request.text_summary and request.session_id:
+            if request.session_id == NEW_SESSION:
+                session_id = create_session(redis_client, request.pdf_name, request.markdown_filename)
+                session = load_session(redis_client, session_id)
+            else:
+                session_id = request.session_id
+                session = load_session(redis_client, session_id)
+                if session is None:
+                    raise HTTPException(status_code=404, detail=f"Chat session '{session_id}' not found or expired.")
+                if session.get("pdf_name") != request.pdf_name:
+                    raise HTTPException(status_code=400, detail="Chat session belongs to a different document.")
+        history = get_history(session)
+        has_history = bool(history["turns"] or history["summary"])
+
         # Generate a unique cache key including the LLM model name
-        cache_key = f"{request.pdf_name}:{request.question}:{request.text_summary}:{request.llm_choice}"
+        cache_key = chat_cache_key(request.pdf_name, request.question, request.text_summary, request.llm_choice)
 
-        # ✅ Check Redis cache first
-        cached_response = get_cached_response(cache_key)
+        # ✅ Check Redis cache first (follow-up questions depend on the history, so they are not cached)
+        cached_response = None if has_history else get_cached_response(cache_key)
         if cached_response:
             try:
                 cached_response = json.loads(cached_response)  # Ensure it is a dictionary
+                if session is not None:
+                    remember_turn(session_id, session, request.question, cached_response.get("response", ""), request.pdf_name, background_tasks)
+                background_tasks.add_task(record_usage, redis_client,
+                                          [usage_entry(kind, request.pdf_name, cached_response, cache_hit=True)])
                 return {
                     "answer": cached_response.get("response", "No response available."),
                     "tokens_used": cached_response.get("tokens_used", "N/A"),
                     "input_tokens": cached_response.get("input_tokens", "N/A"),
                     "output_tokens": cached_response.get("output_tokens", "N/A"),
-                    "cost": cached_response.get("cost", "N/A"),
+                    "cost": 0.0,  # Nothing spent on a cache hit
+                    "saved_cost": cached_response.get("cost", 0.0),
                     "cached": True,
-                    "llm_choice": request.llm_choice
+                    "llm_choice": request.llm_choice,
+                    "routing": cached_response.get("routing"),
+                    "session_id": session_id
                 }
             except json.JSONDecodeError:
                 pass  # If cache is corrupted, ignore and continue fresh request
 
+        # ✅ Per-caller rate limit (cached answers above do not count)
+        try:
+            rate_limiter.check_caller(get_caller_id(http_request))
+        except RateLimitExceeded as e:
+            raise rate_limited(e.retry_after, str(e))
+
         # ✅ Fetch Markdown content from S3 if Markdown file is selected
-        if request.markdown_filename:
-            markdown_content = get_markdown_from_s3(request.pdf_name, request.markdown_filename)
-            pdf_data = {"pdf_content": markdown_content or "No content available.", "tables": []}
-        elif request.pdf_json:
-            pdf_data = json.loads(request.pdf_json)
-        else:
-            raise HTTPException(status_code=400, detail="No valid input provided.")
-
-        # ✅ Process the request based on `text_summary` flag
-        answer = process_request(
-            pdf_data=pdf_data,
-            question=request.question,
-            llm_choice=None if request.text_summary else request.llm_choice,  # LLM not needed for summary
-            text_summary=request.text_summary
-        )
-
-        # ✅ Extract tokens & cost calculations if response contains usage data
-        usage = answer.get("usage", {})
-        input_tokens = usage.get("prompt_tokens", 0)
-        output_tokens = usage.get("completion_tokens", 0)
-
-        input_token_cost = input_tokens * 0.00000015  # ✅ Cost per input token
-        output_token_cost = output_tokens * 0.0000006  # ✅ Cost per output token
-        total_cost = input_token_cost + output_token_cost  # ✅ Total cost
-
-        # ✅ Ensure `answer` is a dictionary before storing in Redis
-        if not isinstance(answer, dict):
-            answer = {
-                "response": str(answer),
-                "tokens_used": "N/A",
-                "input_tokens": input_tokens,
-                "output_tokens": output_tokens,
-                "cost": total_cost
-            }
+        pdf_data = load_pdf_data(request.pdf_name, request.markdown_filename, request.pdf_json)
+
+        # ✅ Process the request based on `text_summary` flag (failures raise and are never cached)
+        try:
+            answer = process_request(
+                pdf_data=pdf_data,
+                question=request.question,
+                llm_choice=None if request.text_summary else request.llm_choice,  # LLM not needed for summary
+                text_summary=request.text_summary,
+                history=history,
+                hedge=request.hedge,
+                limiter=rate_limiter,
+                on_discarded=discarded_usage_recorder(kind, request.pdf_name)
+            )
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        except RateLimitExceeded as e:
+            raise rate_limited(e.retry_after, str(e))
+        except LLMRoutingError as e:
+            if e.retry_after is not None:
+                raise rate_limited(e.retry_after, {"error": "All LLM providers are rate limited.", "attempts": e.attempts})
+            raise HTTPException(status_code=502, detail={"error": str(e), "attempts": e.attempts})
+
+        # ✅ Record tokens & cost (priced per model in cost_ledger) off the request path
+        background_tasks.add_task(record_usage, redis_client, [usage_entry(kind, request.pdf_name, answer)])
 
         # ✅ Cache response in Redis (storing it as a JSON string)
-        set_cached_response(cache_key, json.dumps(answer))
+        # Answers served by a fallback model are not cached under the requested model's key
+        routing = answer.get("routing") or {}
+        if not has_history and not routing.get("fallback"):
+            set_cached_response(cache_key, json.dumps(answer))
+
+        # ✅ Remember the turn so follow-up questions keep their context
+        if session is not None:
+            remember_turn(session_id, session, request.question, answer.get("response", ""), request.pdf_name, background_tasks)
 
         return {
             "answer": answer.get("response", "No response available."),
             "tokens_used": answer.get("tokens_used", "N/A"),
-            "input_tokens": input_tokens,
-            "output_tokens": output_tokens,
-            "cost": total_cost,
+            "input_tokens": answer.get("input_tokens", 0),
+            "output_tokens": answer.get("output_tokens", 0),
+            "cached_input_tokens": answer.get("cached_input_tokens", 0),
+            "cost": answer.get("cost", 0.0),
             "cached": False,
-            "llm_choice": request.llm_choice
+            "llm_choice": request.llm_choice,
+            "routing": answer.get("routing"),
+            "session_id": session_id
         }
 
+    except HTTPException:
+        raise
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error processing request: {e}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"Error processing request: {e}")
+ 
+@app.delete("/chat/session/{session_id}")
+def end_chat_session(session_id: str):
+    """Deletes a chat session and its stored history."""
+    if not delete_session(redis_client, session_id):
+        raise HTTPException(status_code=404, detail=f"Chat session '{session_id}' not found.")
+    return {"deleted": session_id}
+ 
+@app.get("/llm/health/")
+def llm_health():
+    """Live latency / error statistics used for LLM routing (per worker)."""
+    return {"providers": provider_health()}
+ 
+@app.post("/chat/batch/")
+def chat_batch(request: BatchChatRequest, http_request: Request):
+    """
+    Answers many questions about one document in a single pass.
+    The document is loaded once, cached answers come straight from Redis, and the rest are
+    packed into as few multi-question LLM prompts as fit the token budget.
+    Streams NDJSON: one line per question as it is answered, then a final `summary` line with aggregated cost.
+    """
+    if not request.questions:
+        raise HTTPException(status_code=400, detail="At least one question is required.")
+    try:
+        normalize_llm_choice(request.llm_choice)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    pdf_data = load_pdf_data(request.pdf_name, request.markdown_filename, request.pdf_json)
+    cache_keys = [chat_cache_key(request.pdf_name, question, False, request.llm_choice) for question in request.questions]
+    cached_responses = get_cached_responses(cache_keys)
+
+    # ✅ Per-caller rate limit, charged per question that needs the LLM (cached answers are free)
+    uncached_questions = {question for question, cached_value in zip(request.questions, cached_responses)
+                          if not cached_value}
+    if uncached_questions:
+        try:
+            rate_limiter.check_caller(get_caller_id(http_request), cost=len(uncached_questions))
+        except RateLimitExceeded as e:
+            raise rate_limited(e.retry_after, str(e))
+
+    ledger_entries = []  # Written to the cost ledger once the stream has finished
+
+    def stream():
+        totals = {"questions": len(request.questions), "answered": 0, "cached": 0, "failed": 0,
+                  "input_tokens": 0, "output_tokens": 0, "cost": 0.0}
+
+        # Cached answers first; identical uncached questions are only sent to the LLM once
+        pending = {}  # question -> indexes asking it
+        for index, (question, cached_value) in enumerate(zip(request.questions, cached_responses)):
+            cached_response = json.loads(cached_value) if isinstance(cached_value, str) else cached_value
+            if cached_response:
+                totals["answered"] += 1
+                totals["cached"] += 1
+                ledger_entries.append(usage_entry("batch", request.pdf_name, cached_response, cache_hit=True))
+                yield json.dumps({"index": index, "question": question, "cached": True,
+                                  "answer": cached_response.get("response", "No response available."),
+                                  "cost": 0.0}) + "\n"
+            else:
+                pending.setdefault(question, []).append(index)
+
+        unique_questions = list(pending)
+        events = answer_questions_batch(pdf_data, unique_questions, request.llm_choice,
+                                        hedge=request.hedge, limiter=rate_limiter,
+                                        on_discarded=discarded_usage_recorder("batch", request.pdf_name))
+        finished = False
+        try:
+            for event in events:
+                question = unique_questions[event.pop("index")]
+                if event.get("cost") or event.get("input_tokens"):  # Failed retries can still carry packed-call spend
+                    totals["input_tokens"] += event["input_tokens"]
+                    totals["output_tokens"] += event["output_tokens"]
+                    totals["cost"] += event["cost"]
+                    ledger_entries.append(usage_entry("batch", request.pdf_name, event))
+                if "error" in event:
+                    totals["failed"] += len(pending[question])
+                else:
+                    totals["answered"] += len(pending[question])
+                    if not (event.get("routing") or {}).get("fallback"):
+                        set_cached_response(cache_keys[pending[question][0]], json.dumps({
+                            "response": event["answer"],
+                            "model": event.get("model"),
+                            "input_tokens": event["input_tokens"],
+                            "cached_input_tokens": event["cached_input_tokens"],
+                            "output_tokens": event["output_tokens"],
+                            "cost": event["cost"],
+                            "routing": event.get("routing"),
+                        }))
+                for index in pending[question]:
+                    yield json.dumps({"index": index, "question": question, "cached": False, **event}) + "\n"
+
+            yield json.dumps({"summary": totals}) + "\n"
+            finished = True
+        finally:
+            events.close()  # Client gone: cancel the groups not sent to the LLM yet
+            if not finished:
+                # The background task only runs after a complete response, so record the spend so far here
+                record_usage(redis_client, list(ledger_entries))
+                ledger_entries.clear()
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson",
+                             background=BackgroundTask(record_usage, redis_client, ledger_entries))
+ 
+@app.get("/usage/summary/")
+def get_usage_summary(group_by: str = "document"):
+    """
+    Aggregated LLM usage from the cost ledger, grouped by `document`, `model` or `day`:
+    requests, cache hits, tokens, cost and the spend saved by response / prompt caching.
+    """
+    if group_by not in AGGREGATE_DIMENSIONS:
+        raise HTTPException(status_code=400, detail=f"group_by must be one of {', '.join(AGGREGATE_DIMENSIONS)}.")
+    summary = usage_summary(redis_client, group_by)
+    totals = {field: sum(row[field] for row in summary.values()) for field in next(iter(summary.values()), {})}
+    return {"group_by": group_by, "usage": summary, "totals": totals}
+ 
+@app.get("/usage/ledger/")
+def get_usage_ledger(count: int = 100):
+    """Most recent raw entries of the append-only usage ledger."""
+    return {"entries": read_ledger(redis_client, count=min(count, 1000))}
@@ -1,36 +1,36 @@
 # backend/pdf_markdown_convertor.py
  
-import fitz  # PyMuPDF for image extraction
-import pdfplumber  # For text and table extraction
 import os
 import re
-import pandas as pd
-import boto3
-import tempfile
+from storage import get_storage
+from dotenv import load_dotenv
  
-# Load AWS credentials dynamically from environment variables
-AWS_ACCESS_KEY_ID = os.getenv("AWS_ACCESS_KEY_ID")
-AWS_SECRET_ACCESS_KEY = os.getenv("AWS_SECRET_ACCESS_KEY")
-AWS_DEFAULT_REGION = os.getenv("AWS_DEFAULT_REGION")
-S3_BUCKET_NAME = os.getenv("S3_BUCKET_NAME")
+# Files go to the storage backend selected by STORAGE_BACKEND (S3, local disk or both)
+load_dotenv()
  
-# Initialize S3 Client
-s3_client = boto3.client(
-    "s3",
-    aws_access_key_id=AWS_ACCESS_KEY_ID,
-    aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
-    region_name=AWS_DEFAULT_REGION,
-)
+ 
+def clean_pdf_name(filename: str) -> str:
+    """Cleans the PDF filename by removing unwanted characters like (1), spaces, and file extensions."""
+    filename = os.path.splitext(os.path.basename(filename))[0]  # Remove folders & extension
+    filename = re.sub(r"[^a-zA-Z0-9_-]", "_", filename)  # Replace spaces & special chars
+    return filename.strip("_")  # Remove trailing underscores
  
  
 def upload_file_to_s3(file_path, s3_key):
-    """Uploads a file to S3 and returns its public URL."""
+    """Uploads a file to storage and returns its public URL."""
     try:
-        s3_client.upload_file(file_path, S3_BUCKET_NAME, s3_key)
-        s3_url = f"https://{S3_BUCKET_NAME}.s3.{AWS_DEFAULT_REGION}.amazonaws.com/{s3_key}"
-        return s3_url
+        return get_storage().upload_file(file_path, s3_key)
     except Exception as e:
-        print(f"⚠️ Failed to upload {file_path} to S3: {e}")
+        print(f"⚠️ Failed to upload {file_path} to storage: {e}")
+        return None
+ 
+ 
+def upload_bytes_to_s3(data: bytes, s3_key):
+    """Writes in-memory content to storage (no temp file) and returns its public URL."""
+    try:
+        return get_storage().write_bytes(s3_key, data)
+    except Exception as e:
+        print(f"⚠️ Failed to upload {s3_key} to storage: {e}")
         return None
  
  
@@ -42,6 +42,10 @@ def clean_text(text):
  
 def extract_pdf_content(pdf_path, s3_folder):
     """Extracts text, tables, and images while maintaining document order."""
+    import fitz  # PyMuPDF for image extraction
+    import pdfplumber  # For text and table extraction
+    import pandas as pd
+
     doc = fitz.open(pdf_path)
     md_content = ""
  
@@ -78,15 +82,9 @@ def extract_pdf_content(pdf_path, s3_folder):
                 image_ext = base_image["ext"]
                 img_filename = f"image_{page_num+1}_{img_index+1}.{image_ext}"
  
-                # Save image temporarily
-                with tempfile.NamedTemporaryFile(delete=False, suffix=f".{image_ext}") as tmp_img:
-                    tmp_img.write(image_bytes)
-                    tmp_path = tmp_img.name
- 
                 # Fix: Ensure images are uploaded under "Images/" inside the PDF folder
                 s3_image_key = f"{image_folder}{img_filename}"  # Fix: Correct image path
-                s3_url = upload_file_to_s3(tmp_path, s3_image_key)
-                os.remove(tmp_path)
+                s3_url = upload_bytes_to_s3(image_bytes, s3_image_key)
  
                 if s3_url:
                     md_content += f"![Image]({s3_url})\n\n"
@@ -112,19 +110,14 @@ def pdf_to_markdown_s3(pdf_path, pdf_name):
     # Extract content while maintaining document order
     md_content = extract_pdf_content(pdf_path, s3_folder)
  
-    # Save Markdown to a **single file**
-    markdown_temp_path = os.path.join(tempfile.gettempdir(), markdown_filename)
-    with open(markdown_temp_path, "w", encoding="utf-8") as md_file:
-        md_file.write(md_content)
- 
-    # Upload Markdown to S3
-    md_s3_url = upload_file_to_s3(markdown_temp_path, s3_markdown_key)
-    os.remove(markdown_temp_path)
+    # Save Markdown to a **single file** in storage
+    md_s3_url = upload_bytes_to_s3(md_content.encode("utf-8"), s3_markdown_key)
  
     return {
         "pdf_url": pdf_s3_url,
         "markdown_url": md_s3_url,
-        "s3_folder": s3_folder  # Now this will have the correct name
+        "s3_folder": s3_folder,  # Now this will have the correct name
+        "markdown_content": md_content  # Lets callers show the result without fetching it back from S3
     }
  
  
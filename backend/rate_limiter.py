@@ -0,0 +1,164 @@
+# backend/rate_limiter.py
+
+import os
+import json
+import time
+import uuid
+import random
+from contextlib import contextmanager
+
+# Default limits per provider: requests/min, tokens/min and concurrent calls.
+# Override with LLM_RATE_LIMITS='{"gpt-4o mini": {"rpm": 100, "tpm": 50000, "concurrency": 5}}'
+PROVIDER_LIMITS = {
+    "gpt-4o mini": {"rpm": 500, "tpm": 200000, "concurrency": 20},
+    "gemini flash free": {"rpm": 15, "tpm": 1000000, "concurrency": 5},
+    "deepseek chat": {"rpm": 300, "tpm": 300000, "concurrency": 10},
+    "claude-3.5 haiku": {"rpm": 50, "tpm": 50000, "concurrency": 5},
+}
+for _provider, _limits in json.loads(os.getenv("LLM_RATE_LIMITS", "{}")).items():
+    PROVIDER_LIMITS.setdefault(_provider, {}).update(_limits)
+
+CALLER_RPM = int(os.getenv("CALLER_RPM", "30"))  # Requests/min allowed per caller
+MAX_QUEUE_WAIT = float(os.getenv("RATE_LIMIT_MAX_WAIT", "10"))  # Seconds a request may queue
+MAX_QUEUE_DEPTH = int(os.getenv("RATE_LIMIT_MAX_QUEUE", "50"))  # Requests allowed to queue per key
+QUEUE_LEASE = int(MAX_QUEUE_WAIT) * 2 + 1  # Seconds before a queue place left by a crashed worker expires
+SLOT_LEASE = 120  # Seconds a concurrency slot is held if the worker dies without releasing it
+SLOT_POLL_INTERVAL = 0.2
+
+# Atomically takes `cost` from every bucket, or nothing. Returns the wait (seconds) until all fit.
+# ARGV holds (capacity, refill per second, cost) for each key. Uses Redis' clock so all workers agree.
+TOKEN_BUCKET_SCRIPT = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local wait = 0
+local levels = {}
+for i, key in ipairs(KEYS) do
+    local capacity = tonumber(ARGV[(i - 1) * 3 + 1])
+    local rate = tonumber(ARGV[(i - 1) * 3 + 2])
+    local cost = math.min(tonumber(ARGV[(i - 1) * 3 + 3]), capacity)
+    local state = redis.call('HMGET', key, 'tokens', 'ts')
+    local tokens = tonumber(state[1]) or capacity
+    local ts = tonumber(state[2]) or now
+    tokens = math.min(capacity, tokens + math.max(now - ts, 0) * rate)
+    levels[i] = tokens - cost
+    if tokens < cost then
+        wait = math.max(wait, (cost - tokens) / rate)
+    end
+end
+if wait > 0 then
+    return tostring(wait)
+end
+for i, key in ipairs(KEYS) do
+    local capacity = tonumber(ARGV[(i - 1) * 3 + 1])
+    local rate = tonumber(ARGV[(i - 1) * 3 + 2])
+    redis.call('HSET', key, 'tokens', levels[i], 'ts', now)
+    redis.call('EXPIRE', key, math.ceil(capacity / rate) + 60)
+end
+return '0'
+"""
+
+# Takes one concurrency slot (a lease that expires if never released). Returns 1 on success.
+CONCURRENCY_SCRIPT = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now)
+if redis.call('ZCARD', KEYS[1]) < tonumber(ARGV[1]) then
+    redis.call('ZADD', KEYS[1], now + tonumber(ARGV[2]), ARGV[3])
+    redis.call('EXPIRE', KEYS[1], tonumber(ARGV[2]))
+    return 1
+end
+return 0
+"""
+
+# Joins a wait queue as a member that expires after ARGV[1] seconds (so crashed workers don't leak
+# queue places). Returns the queue depth including this request; leaving the queue is a ZREM.
+QUEUE_SCRIPT = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now)
+redis.call('ZADD', KEYS[1], now + tonumber(ARGV[1]), ARGV[2])
+redis.call('EXPIRE', KEYS[1], tonumber(ARGV[1]))
+return redis.call('ZCARD', KEYS[1])
+"""
+
+
+class RateLimitExceeded(Exception):
+    """Raised when a request cannot be admitted within the queue limits."""
+
+    status_code = 429  # Lets the LLM router treat a locally limited provider like a provider 429
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class RateLimiter:
+    """
+    Redis-backed token buckets (per provider and per caller) and concurrency caps.
+    All state lives in Redis, so limits hold across multiple uvicorn workers.
+    """
+
+    def __init__(self, redis_client):
+        self.redis_client = redis_client
+        self.take_buckets = redis_client.register_script(TOKEN_BUCKET_SCRIPT)
+        self.take_slot = redis_client.register_script(CONCURRENCY_SCRIPT)
+        self.join_queue = redis_client.register_script(QUEUE_SCRIPT)
+
+    def _wait_for_buckets(self, name: str, buckets: list, deadline: float):
+        """Queues until every bucket `(key, capacity, refill_per_sec, cost)` can pay its cost."""
+        keys = [key for key, _, _, _ in buckets]
+        args = [value for _, capacity, rate, cost in buckets for value in (capacity, rate, cost)]
+        queue_key = f"ratelimit:queue:{name}"
+        queued = None  # Our member in the queue ZSET, once we had to wait
+        try:
+            while True:
+                wait = float(self.take_buckets(keys=keys, args=args))
+                if wait <= 0:
+                    return
+                if not queued:
+                    queued = uuid.uuid4().hex
+                    depth = self.join_queue(keys=[queue_key], args=[QUEUE_LEASE, queued])
+                    if depth > MAX_QUEUE_DEPTH:
+                        raise RateLimitExceeded(f"Rate limit queue for '{name}' is full.", wait)
+                if time.monotonic() + wait > deadline:
+                    raise RateLimitExceeded(f"Rate limit for '{name}' exceeded.", wait)
+                time.sleep(wait + random.uniform(0, 0.05))  # Jitter avoids synchronized retries
+        finally:
+            if queued:
+                self.redis_client.zrem(queue_key, queued)
+
+    def check_caller(self, caller: str, cost: int = 1):
+        """
+        Admits `cost` requests (e.g. the questions of a batch) for `caller`, queueing briefly.
+        Raises RateLimitExceeded when over the limit.
+        """
+        bucket = (f"ratelimit:caller:{caller}", CALLER_RPM, CALLER_RPM / 60, cost)
+        self._wait_for_buckets(f"caller:{caller}", [bucket], time.monotonic() + MAX_QUEUE_WAIT)
+
+    @contextmanager
+    def provider_slot(self, provider: str, tokens: int):
+        """
+        Holds a request/token budget and a concurrency slot for one provider call.
+        Queues for up to `MAX_QUEUE_WAIT` seconds, then raises RateLimitExceeded.
+        """
+        limits = PROVIDER_LIMITS.get(provider)
+        if not limits:
+            yield
+            return
+
+        deadline = time.monotonic() + MAX_QUEUE_WAIT
+        self._wait_for_buckets(f"provider:{provider}", [
+            (f"ratelimit:rpm:{provider}", limits["rpm"], limits["rpm"] / 60, 1),
+            (f"ratelimit:tpm:{provider}", limits["tpm"], limits["tpm"] / 60, tokens),
+        ], deadline)
+
+        slot_key = f"ratelimit:concurrency:{provider}"
+        holder = uuid.uuid4().hex
+        while not self.take_slot(keys=[slot_key], args=[limits["concurrency"], SLOT_LEASE, holder]):
+            if time.monotonic() + SLOT_POLL_INTERVAL > deadline:
+                raise RateLimitExceeded(f"Too many concurrent requests to '{provider}'.", SLOT_POLL_INTERVAL * 5)
+            time.sleep(SLOT_POLL_INTERVAL)
+        try:
+            yield
+        finally:
+            self.redis_client.zrem(slot_key, holder)
@@ -0,0 +1,261 @@
+# backend/storage.py
+#
+# Where PDFs, Markdown files and images live. Selected with STORAGE_BACKEND:
+#   s3            - the S3 bucket (default)
+#   local         - a directory on local disk (LOCAL_STORAGE_DIR); files are served by the API under /files/
+#   write_through - local hot copy in front of S3: writes go to both, reads are served from disk;
+#                   missing or outdated files (ETag check, at most every WRITE_THROUGH_REVALIDATE
+#                   seconds per file) are pulled from S3, so writes by other nodes show up
+
+import os
+import mmap
+import time
+import logging
+import threading
+import shutil
+import tempfile
+import urllib.parse
+from functools import lru_cache
+from dotenv import load_dotenv
+
+load_dotenv()
+
+LOCAL_FILES_ROUTE = "/files"  # Static route the API mounts for the local backend
+TMP_SUFFIX = ".tmp"  # In-progress local writes, skipped when listing
+WRITE_THROUGH_REVALIDATE = float(os.getenv("WRITE_THROUGH_REVALIDATE", "60"))  # Seconds a hot copy is trusted
+
+
+class S3Storage:
+    """Objects in an S3 bucket (or an S3-compatible endpoint such as MinIO)."""
+
+    def __init__(self):
+        self.bucket = os.getenv("S3_BUCKET_NAME")
+        self.region = os.getenv("AWS_DEFAULT_REGION")
+        self.endpoint_url = os.getenv("S3_ENDPOINT_URL")  # Optional: S3-compatible stand-in for local runs
+        self._client = None
+
+    @property
+    def client(self):
+        """S3 client, created on first use (boto3 is slow to import)."""
+        if self._client is None:
+            import boto3
+            self._client = boto3.client(
+                "s3",
+                aws_access_key_id=os.getenv("AWS_ACCESS_KEY_ID"),
+                aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY"),
+                region_name=self.region,
+                endpoint_url=self.endpoint_url,
+            )
+        return self._client
+
+    def public_url(self, key: str) -> str:
+        """Public URL of an object (path-style when a custom S3 endpoint is used)."""
+        quoted = urllib.parse.quote(key)
+        if self.endpoint_url:
+            return f"{self.endpoint_url.rstrip('/')}/{self.bucket}/{quoted}"
+        return f"https://{self.bucket}.s3.{self.region}.amazonaws.com/{quoted}"
+
+    def upload_file(self, file_path: str, key: str) -> str:
+        self.client.upload_file(file_path, self.bucket, key)
+        return self.public_url(key)
+
+    def write_bytes(self, key: str, data: bytes) -> str:
+        self.client.put_object(Bucket=self.bucket, Key=key, Body=data)
+        return self.public_url(key)
+
+    def _get(self, key: str, **kwargs) -> bytes:
+        try:
+            return self.client.get_object(Bucket=self.bucket, Key=key, **kwargs)["Body"].read()
+        except self.client.exceptions.NoSuchKey:
+            raise FileNotFoundError(key)
+
+    def read_bytes(self, key: str) -> bytes:
+        return self._get(key)
+
+    def read_text(self, key: str) -> str:
+        return self._get(key).decode("utf-8")
+
+    def read_range(self, key: str, start: int, end: int | None = None) -> bytes:
+        """Bytes [start, end) of an object (to the end if `end` is None)."""
+        byte_range = f"bytes={start}-{'' if end is None else end - 1}"
+        return self._get(key, Range=byte_range)
+
+    def _head(self, key: str) -> dict:
+        try:
+            return self.client.head_object(Bucket=self.bucket, Key=key)
+        except self.client.exceptions.ClientError as e:
+            # HEAD responses have no body, so a missing key only shows up as a 404 status
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                raise FileNotFoundError(key)
+            raise
+
+    def size(self, key: str) -> int:
+        return self._head(key)["ContentLength"]
+
+    def etag(self, key: str) -> str:
+        """Version tag of an object; changes whenever the object is rewritten."""
+        return self._head(key)["ETag"]
+
+    def list_keys(self, prefix: str = "") -> list:
+        keys = []
+        paginator = self.client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix):
+            keys.extend(obj["Key"] for obj in page.get("Contents", []))
+        return keys
+
+
+class LocalStorage:
+    """Files in a local directory. Reads use mmap, so ranged reads only touch the pages they need."""
+
+    def __init__(self, root: str, base_url: str):
+        self.root = os.path.abspath(root)
+        self.base_url = base_url.rstrip("/")
+        os.makedirs(self.root, exist_ok=True)
+
+    def path(self, key: str) -> str:
+        """Filesystem path of a key; keys cannot escape the storage directory."""
+        path = os.path.abspath(os.path.join(self.root, key))
+        if os.path.commonpath([self.root, path]) != self.root:
+            raise FileNotFoundError(key)
+        return path
+
+    def public_url(self, key: str) -> str:
+        return f"{self.base_url}{LOCAL_FILES_ROUTE}/{urllib.parse.quote(key)}"
+
+    def upload_file(self, file_path: str, key: str) -> str:
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        shutil.copyfile(file_path, path)
+        return self.public_url(key)
+
+    def write_bytes(self, key: str, data: bytes) -> str:
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Unique temp file per write, so concurrent writes to the same key (threads or processes) don't collide
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=f".{os.path.basename(path)}.",
+                                        suffix=TMP_SUFFIX)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)  # Readers never see a half-written file
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        return self.public_url(key)
+
+    def read_range(self, key: str, start: int, end: int | None = None) -> bytes:
+        """Bytes [start, end) of a file (to the end if `end` is None), read through mmap."""
+        with open(self.path(key), "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return b""
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                return mapped[start:end]
+
+    def read_bytes(self, key: str) -> bytes:
+        return self.read_range(key, 0)
+
+    def read_text(self, key: str) -> str:
+        return self.read_bytes(key).decode("utf-8")
+
+    def size(self, key: str) -> int:
+        return os.path.getsize(self.path(key))
+
+    def list_keys(self, prefix: str = "") -> list:
+        keys = []
+        for root, _, files in os.walk(self.root):
+            for name in files:
+                if name.endswith(TMP_SUFFIX):
+                    continue
+                key = os.path.relpath(os.path.join(root, name), self.root).replace(os.sep, "/")
+                if key.startswith(prefix):
+                    keys.append(key)
+        return sorted(keys)
+
+
+class WriteThroughStorage:
+    """
+    A local hot copy in front of S3: writes go to both, reads come from disk. A hot copy is trusted for
+    `WRITE_THROUGH_REVALIDATE` seconds, then its S3 ETag is checked and it is fetched again if the object
+    changed (e.g. re-converted by another node or by bulk_ingest.py against plain S3).
+    """
+
+    def __init__(self, local: LocalStorage, remote: S3Storage, revalidate_after: float = WRITE_THROUGH_REVALIDATE):
+        self.local = local
+        self.remote = remote
+        self.revalidate_after = revalidate_after
+        self.versions = {}  # key -> (S3 ETag of the local copy, monotonic time it was last checked)
+        self.lock = threading.Lock()
+
+    def public_url(self, key: str) -> str:
+        return self.remote.public_url(key)  # S3 stays the durable, shareable copy
+
+    def upload_file(self, file_path: str, key: str) -> str:
+        self.local.upload_file(file_path, key)
+        url = self.remote.upload_file(file_path, key)
+        self._forget(key)
+        return url
+
+    def write_bytes(self, key: str, data: bytes) -> str:
+        self.local.write_bytes(key, data)
+        url = self.remote.write_bytes(key, data)
+        self._forget(key)
+        return url
+
+    def _forget(self, key: str):
+        with self.lock:
+            self.versions.pop(key, None)  # Next read records the new ETag (and refetches once)
+
+    def _ensure_local(self, key: str):
+        """Makes sure the local copy exists and matches S3 (checked at most every `revalidate_after` seconds)."""
+        now = time.monotonic()
+        with self.lock:
+            known = self.versions.get(key)
+        has_local = os.path.exists(self.local.path(key))
+        if has_local and known and now - known[1] < self.revalidate_after:
+            return
+        try:
+            etag = self.remote.etag(key)
+        except FileNotFoundError:
+            raise
+        except Exception as e:
+            if not has_local:
+                raise
+            logging.warning(f"Could not revalidate '{key}' against S3, serving the local copy: {e}")
+            return
+        if not has_local or not known or known[0] != etag:
+            self.local.write_bytes(key, self.remote.read_bytes(key))
+        with self.lock:
+            self.versions[key] = (etag, now)
+
+    def read_range(self, key: str, start: int, end: int | None = None) -> bytes:
+        self._ensure_local(key)
+        return self.local.read_range(key, start, end)
+
+    def read_bytes(self, key: str) -> bytes:
+        self._ensure_local(key)
+        return self.local.read_bytes(key)
+
+    def read_text(self, key: str) -> str:
+        return self.read_bytes(key).decode("utf-8")
+
+    def size(self, key: str) -> int:
+        self._ensure_local(key)
+        return self.local.size(key)
+
+    def list_keys(self, prefix: str = "") -> list:
+        return self.remote.list_keys(prefix)  # S3 is the source of truth for what exists
+
+
+@lru_cache(maxsize=None)
+def get_storage():
+    """The storage backend selected by STORAGE_BACKEND (one instance per process)."""
+    backend = os.getenv("STORAGE_BACKEND", "s3").lower()
+    local_dir = os.getenv("LOCAL_STORAGE_DIR", "storage")
+    base_url = os.getenv("PUBLIC_BASE_URL", "http://localhost:8000")
+    if backend == "s3":
+        return S3Storage()
+    if backend == "local":
+        return LocalStorage(local_dir, base_url)
+    if backend == "write_through":
+        return WriteThroughStorage(LocalStorage(local_dir, base_url), S3Storage())
+    raise ValueError(f"Unknown STORAGE_BACKEND '{backend}' (expected s3, local or write_through).")
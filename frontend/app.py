@@ -1,147 +1,285 @@
 # frontend/app.py
- 
+
 import streamlit as st
 import requests
 import json
 import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
 from dotenv import load_dotenv
- 
+
 # Load environment variables
 load_dotenv()
- 
+
 # Backend API Endpoints
 UPLOAD_URL = "http://localhost:8000/upload_pdf/"
 CHAT_URL = "http://localhost:8000/chat/"
 FETCH_MARKDOWN_URL = "http://localhost:8000/fetch_markdown_files/"
 GET_MARKDOWN_CONTENT_URL = "http://localhost:8000/get_markdown_content/"
 GET_IMAGES_URL = "http://localhost:8000/get_images/"  # API to fetch images
- 
+
+# Cache lifetimes (seconds)
+CATALOG_TTL = 60  # New uploads clear this cache right away
+MARKDOWN_TTL = 600
+
 # Sidebar Navigation
 st.sidebar.title("📌 Navigation")
 page = st.sidebar.radio("Go to:", ["Upload & Convert PDF", "Use Existing Markdown"])
 
 # LLM Options
 LLM_OPTIONS = ["GPT-4o Mini", "Gemini Flash Free", "DeepSeek", "Claude-3.5 Haiku"]
- 
+
+########################################
+#         Backend Client Helpers       #
+########################################
+@st.cache_resource
+def get_http_session() -> requests.Session:
+    """One pooled keep-alive session shared by all reruns and users of this app process."""
+    session = requests.Session()
+    session.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=16))
+    session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=16))
+    return session
+
+
+@st.cache_resource
+def get_executor() -> ThreadPoolExecutor:
+    """Runs chat requests in the background so the page keeps rendering while the LLM answers."""
+    return ThreadPoolExecutor(max_workers=8)
+
+
+@st.cache_data(ttl=CATALOG_TTL, show_spinner=False)
+def fetch_markdown_files():
+    """
+    Markdown files grouped by PDF folder (cached, so widget interactions don't list the bucket again).
+    Raises on backend errors so a failure is not cached.
+    """
+    response = get_http_session().get(FETCH_MARKDOWN_URL)
+    response.raise_for_status()
+    return response.json().get("markdown_files", {})
+
+
+@st.cache_data(ttl=MARKDOWN_TTL, show_spinner=False)
+def fetch_markdown_content(pdf_name: str, markdown_filename: str) -> str:
+    """Content of one Markdown file (cached per document). Raises on backend errors so a failure is not cached."""
+    response = get_http_session().post(
+        GET_MARKDOWN_CONTENT_URL,
+        json={"pdf_name": pdf_name, "markdown_filename": markdown_filename}
+    )
+    response.raise_for_status()
+    return response.json().get("markdown_content", "")
+
+
+def load_markdown_content(pdf_name: str, markdown_filename: str) -> str | None:
+    """Cached Markdown content, or None if the backend could not provide it (retried on the next rerun)."""
+    try:
+        return fetch_markdown_content(pdf_name, markdown_filename)
+    except requests.RequestException:
+        return None
+
+
+def post_chat(payload: dict, user_id: str) -> dict:
+    """Sends a chat/summary request (runs in a background thread, so no Streamlit calls here)."""
+    try:
+        # The backend rate-limits per user; without this header all UI users would share this server's IP
+        response = get_http_session().post(CHAT_URL, json=payload, headers={"X-User-Id": user_id})
+    except requests.RequestException as e:
+        return {"status_code": None, "text": str(e)}
+    return {
+        "status_code": response.status_code,
+        "data": response.json() if response.status_code == 200 else None,
+        "text": response.text,
+        "retry_after": response.headers.get("Retry-After"),
+    }
+
+
+def submit_chat(slot: str, payload: dict):
+    """Starts a chat request in the background; its result is collected on a later rerun."""
+    user_id = st.session_state.setdefault("user_id", uuid.uuid4().hex)  # One id per browser session
+    st.session_state[f"{slot}_future"] = get_executor().submit(post_chat, payload, user_id)
+    st.session_state.pop(f"{slot}_result", None)
+
+
+def collect_chat(slot: str) -> str | None:
+    """
+    Moves a finished background request into `st.session_state[f"{slot}_result"]`.
+    Returns "pending" while it runs, "new" right after it finished, otherwise None.
+    """
+    future = st.session_state.get(f"{slot}_future")
+    if future is None:
+        return None
+    if not future.done():
+        return "pending"
+    del st.session_state[f"{slot}_future"]
+    st.session_state[f"{slot}_result"] = future.result()
+    return "new"
+
+
+@st.fragment(run_every=1)
+def wait_for_chat(slot: str, message: str):
+    """Polls a pending request without rerunning the page, then reruns it once the answer is in."""
+    future = st.session_state.get(f"{slot}_future")
+    if future is None or future.done():
+        st.rerun()
+    st.info(message)
+
+
+def show_usage(response_data: dict):
+    input_tokens = response_data.get("input_tokens", "N/A")
+    output_tokens = response_data.get("output_tokens", "N/A")
+    cost = response_data.get("cost", "N/A")
+    st.write(f"📊 **Input Tokens:** {input_tokens}, **Output Tokens:** {output_tokens}, **Cost:** ${cost:.6f}")
+
 ########################################
 #      PAGE 1: Upload & Convert PDF    #
 ########################################
 if page == "Upload & Convert PDF":
     st.title("📄 PDF & Markdown Chatbot with LLM")
- 
+
     st.header("📂 Upload a PDF for Processing")
     uploaded_file = st.file_uploader("Choose a PDF file", type=["pdf"])
-    
+
     if uploaded_file is not None:
-        with st.spinner("⏳ Extracting PDF content..."):
-            files = {"file": uploaded_file}
-            response = requests.post(UPLOAD_URL, files=files)
-            
-            if response.status_code == 200:
-                pdf_data = response.json()
-                pdf_name = pdf_data["s3_folder"].strip('/')  # Ensure no trailing slashes
-                st.success(f"✅ PDF '{uploaded_file.name}' processed and uploaded to S3 successfully!")
- 
-                # Extract correct Markdown filename from backend response
-                md_filename = pdf_data.get("markdown_filename", uploaded_file.name.replace('.pdf', '.md'))
- 
-                # Display extracted Markdown content
-                markdown_url = pdf_data.get("markdown_url")
-                if markdown_url:
-                    
- 
-                    # Fetch Markdown content using correct filename
-                    markdown_response = requests.post(
-                        GET_MARKDOWN_CONTENT_URL,
-                        json={"pdf_name": pdf_name, "markdown_filename": md_filename}
-                    )
-                    if markdown_response.status_code == 200:
-                        extracted_md = markdown_response.json().get("markdown_content", "")
-                        st.text_area("📄 Extracted Markdown Content", extracted_md, height=300)
-                    else:
-                        st.warning(f"⚠️ Unable to fetch Markdown content for {md_filename}.")
- 
+        # The uploader keeps its file across reruns, so remember the result instead of re-uploading
+        upload_key = f"upload:{uploaded_file.name}:{uploaded_file.size}"
+        if upload_key not in st.session_state:
+            with st.spinner("⏳ Extracting PDF content..."):
+                files = {"file": uploaded_file}
+                response = get_http_session().post(UPLOAD_URL, files=files)
+                if response.status_code == 200:
+                    st.session_state[upload_key] = response.json()
+                    fetch_markdown_files.clear()  # New document: refresh the catalog
+                    fetch_markdown_content.clear()  # A re-upload under the same name replaces the old content
+                else:
+                    # Remember failures too, otherwise every rerun would post the PDF again
+                    st.session_state[upload_key] = {"error": response.text}
+        pdf_data = st.session_state.get(upload_key)
+
+        if pdf_data and "error" not in pdf_data:
+            pdf_name = pdf_data["s3_folder"].strip('/')  # Ensure no trailing slashes
+            st.success(f"✅ PDF '{uploaded_file.name}' processed and uploaded to S3 successfully!")
+
+            # Extract correct Markdown filename from backend response
+            md_filename = pdf_data.get("markdown_filename", uploaded_file.name.replace('.pdf', '.md'))
+
+            # Display extracted Markdown content (returned by the upload, no second round-trip)
+            extracted_md = pdf_data.get("markdown_content")
+            if extracted_md is None and pdf_data.get("markdown_url"):
+                extracted_md = load_markdown_content(pdf_name, md_filename)
+            if extracted_md is not None:
+                st.text_area("📄 Extracted Markdown Content", extracted_md, height=300)
             else:
-                st.error("❌ Failed to process PDF")
- 
+                st.warning(f"⚠️ Unable to fetch Markdown content for {md_filename}.")
+
+        else:
+            st.error(f"❌ Failed to process PDF: {pdf_data['error']}")
+            if st.button("🔁 Retry Upload"):
+                del st.session_state[upload_key]
+                st.rerun()
+
 ########################################
 #    PAGE 2: Use Existing Markdown     #
 ########################################
 elif page == "Use Existing Markdown":
     st.title("📁 Select a Markdown File from S3")
- 
-    # Fetch available Markdown files from S3
-    def fetch_markdown_files():
-        response = requests.get(FETCH_MARKDOWN_URL)
-        if response.status_code == 200:
-            return response.json().get("markdown_files", {})
-        return {}
- 
-    markdown_files = fetch_markdown_files()
- 
+
+    # Fetch available Markdown files from S3 (cached)
+    try:
+        markdown_files = fetch_markdown_files()
+    except requests.RequestException as e:
+        st.error(f"❌ Unable to list Markdown files: {e}")
+        st.stop()
+
     if markdown_files:
         selected_pdf = st.selectbox("📁 Select a PDF Folder:", list(markdown_files.keys()))
- 
+
         if selected_pdf and selected_pdf in markdown_files:
             selected_md = st.selectbox("📜 Select a Markdown File:", markdown_files[selected_pdf])
- 
+
+            if st.checkbox("👀 Preview Markdown"):
+                preview = load_markdown_content(selected_pdf, selected_md)
+                if preview is not None:
+                    st.text_area("📄 Markdown Content", preview, height=300)
+                else:
+                    st.warning(f"⚠️ Unable to fetch Markdown content for {selected_md}.")
+
+            # Results belong to one document; start fresh when the selection changes
+            document_key = f"{selected_pdf}/{selected_md}"
+            if st.session_state.get("chat_document") != document_key:
+                st.session_state["chat_document"] = document_key
+                st.session_state["chat_session_id"] = None
+                for slot in ("summary", "chat"):
+                    st.session_state.pop(f"{slot}_result", None)
+
             # Choose between Text Summary and Chat
             action_choice = st.radio("🔍 Choose Action:", ["Text Summary", "Chat with LLM"])
- 
+
             if action_choice == "Text Summary":
                 llm_choice = st.selectbox("🤖 Select LLM for Summary:", LLM_OPTIONS)
-                
+
                 if st.button("📄 Generate Summary"):
-                    with st.spinner("⏳ Summarizing Markdown..."):
-                        response = requests.post(
-                            CHAT_URL,
-                            json={
-                                "question": "Summarize this document.",
-                                "pdf_name": selected_pdf,
-                                "markdown_filename": selected_md,
-                                "llm_choice": llm_choice,
-                                "text_summary": True  # Summary mode enabled
-                            }
-                        )
-                        if response.status_code == 200:
-                            response_data = response.json()
-                            summary = response.json().get("answer", "No summary available.")
-                            input_tokens = response_data.get("input_tokens", "N/A")
-                            output_tokens = response_data.get("output_tokens", "N/A")
-                            cost = response_data.get("cost", "N/A")
-
-                            st.write(summary)
-                            st.write(f"📊 **Input Tokens:** {input_tokens}, **Output Tokens:** {output_tokens}, **Cost:** ${cost:.6f}")
-                        else:
-                            st.error(f"❌ Failed to generate summary: {response.text}")
- 
+                    submit_chat("summary", {
+                        "question": "Summarize this document.",
+                        "pdf_name": selected_pdf,
+                        "markdown_filename": selected_md,
+                        "llm_choice": llm_choice,
+                        "text_summary": True  # Summary mode enabled
+                    })
+
+                if collect_chat("summary") == "pending":
+                    wait_for_chat("summary", "⏳ Summarizing Markdown...")
+                result = st.session_state.get("summary_result")
+                if result:
+                    if result["status_code"] == 200:
+                        response_data = result["data"]
+                        summary = response_data.get("answer", "No summary available.")
+                        st.write(summary)
+                        show_usage(response_data)
+                    else:
+                        st.error(f"❌ Failed to generate summary: {result['text']}")
+
             elif action_choice == "Chat with LLM":
                 llm_choice = st.selectbox("🤖 Select LLM for Chat:", LLM_OPTIONS)
+
+                # One backend chat session per document so follow-up questions have context
+                if st.button("🔄 New Conversation"):
+                    st.session_state["chat_session_id"] = None
+                    st.session_state.pop("chat_result", None)
+
                 user_question = st.text_input("📝 Ask a question about the document:")
- 
+
                 if st.button("🚀 Send Question"):
-                    with st.spinner("⏳ Generating answer..."):
-                        response = requests.post(
-                            CHAT_URL,
-                            json={
-                                "question": user_question,
-                                "pdf_name": selected_pdf,
-                                "markdown_filename": selected_md,
-                                "llm_choice": llm_choice,
-                                "text_summary": False  # Chat mode enabled
-                            }
-                        )
-                        if response.status_code == 200:
-                            response_data = response.json()
-                            answer = response.json().get("answer", "No answer received.")
-                            input_tokens = response_data.get("input_tokens", "N/A")
-                            output_tokens = response_data.get("output_tokens", "N/A")
-                            cost = response_data.get("cost", "N/A")
-                            
-                            st.write("💡 **Answer:**", answer)
-                            st.write(f"📊 **Input Tokens:** {input_tokens}, **Output Tokens:** {output_tokens}, **Cost:** ${cost:.6f}")
-                        else:
-                            st.error("❌ Error from backend: " + response.text)
- 
+                    submit_chat("chat", {
+                        "question": user_question,
+                        "pdf_name": selected_pdf,
+                        "markdown_filename": selected_md,
+                        "llm_choice": llm_choice,
+                        "text_summary": False,  # Chat mode enabled
+                        "session_id": st.session_state.get("chat_session_id") or "new"  # Start a session on the first question
+                    })
+
+                state = collect_chat("chat")
+                if state == "pending":
+                    wait_for_chat("chat", "⏳ Generating answer...")
+                result = st.session_state.get("chat_result")
+                if result and state == "new":
+                    if result["status_code"] == 200:
+                        st.session_state["chat_session_id"] = result["data"].get("session_id")
+                    elif result["status_code"] == 404:
+                        st.session_state["chat_session_id"] = None  # Session expired on the backend
+                if result:
+                    if result["status_code"] == 200:
+                        response_data = result["data"]
+                        answer = response_data.get("answer", "No answer received.")
+                        st.write("💡 **Answer:**", answer)
+                        show_usage(response_data)
+                        routing = response_data.get("routing") or {}
+                        if routing.get("fallback"):
+                            st.caption(f"↪️ {routing.get('requested')} was unavailable, answered by {routing.get('served_by')}.")
+                    elif result["status_code"] == 429:
+                        st.warning(f"⏳ Too many requests right now, retry in {result.get('retry_after') or 'a few'} seconds.")
+                    else:
+                        st.error("❌ Error from backend: " + result["text"])
+
     else:
-        st.warning("⚠️ No Markdown files found in S3.")
\ No newline at end of file
+        st.warning("⚠️ No Markdown files found in S3.")